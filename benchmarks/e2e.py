@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+End-to-end pipeline benchmark
+
+Runs ``kubespray aws`` then ``kubespray deploy`` for clusters of each size
+against the stand-in executables of benchmarks/fakes (git, ansible,
+ansible-playbook, ssh-agent, ssh-add): no network and no cloud account are
+needed. The instances get addresses in 127.0.0.0/8 where a local server
+answers with an SSH banner. For each command it measures the wall time, and
+the CPU time and peak RSS of the CLI process alone (not of the stand-ins),
+then checks them against baselines/e2e.json.
+
+    python benchmarks/e2e.py [--sizes 10 100 1000 10000] [--update]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BIN = os.path.join(ROOT, 'bin', 'kubespray')
+FAKES = os.path.join(HERE, 'fakes')
+BASELINES = os.path.join(HERE, 'baselines', 'e2e.json')
+SIZES = [10, 100, 1000, 10000]
+METRICS = ('wall_s', 'cpu_s', 'rss_mb')
+
+# Runs bin/kubespray in this interpreter and writes its own resource usage
+# when it exits: the children (the stand-ins) are not accounted
+RUNNER = '''
+import atexit, json, os, resource, runpy, sys
+def report():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    with open(os.environ['KUBESPRAY_BENCH_USAGE'], 'w') as f:
+        json.dump({'cpu_s': usage.ru_utime + usage.ru_stime,
+                   'rss_mb': usage.ru_maxrss / 1024.0}, f)
+atexit.register(report)
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+CONFIG = '''\
+kubespray_git_repo: "https://github.com/kubernetes-incubator/kubespray.git"
+kubespray_path: "{work}/kubespray"
+kubespray_cache_dir: "{work}/cache"
+loglevel: "info"
+aws_access_key: "bench"
+aws_secret_key: "bench"
+key_name: "bench"
+ami: "ami-0bench"
+region: "eu-west-1"
+security_group_name: "bench"
+cluster_name: "bench"
+ssh_port: {port}
+ssh_wait_timeout: 120
+'''
+
+
+class BannerServer(object):
+    '''
+    SSH banner server listening on all the addresses, in a thread. On
+    Linux it answers for all of 127.0.0.0/8.
+    '''
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    async def handle(self, reader, writer):
+        writer.write(b'SSH-2.0-OpenSSH_7.2p2 Ubuntu-4ubuntu2.2\r\n')
+        try:
+            await writer.drain()
+        except OSError:
+            pass
+        writer.close()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(asyncio.start_server(
+            self.handle, '0.0.0.0', 0, backlog=1024))
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()
+        return self.port
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def environment(work, tasks):
+    env = dict(os.environ)
+    for var in ['SSH_AUTH_SOCK', 'SSH_AGENT_PID', 'ANSIBLE_CONFIG',
+                'KUBESPRAY_CONFIG', 'KUBESPRAY_INVENTORY']:
+        env.pop(var, None)
+    env['HOME'] = work
+    env['PATH'] = os.pathsep.join([FAKES, env.get('PATH', '')])
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.join(ROOT, 'src')] +
+        [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p]
+    )
+    env['FAKE_ANSIBLE_TASKS'] = str(tasks)
+    return env
+
+
+def run_cli(name, args, env, work, fails=False):
+    '''Run bin/kubespray, returns its metrics. With fails, it must fail'''
+    usage_path = os.path.join(work, '%s.usage.json' % name)
+    out_path = os.path.join(work, '%s.out' % name)
+    env = dict(env, KUBESPRAY_BENCH_USAGE=usage_path)
+    start = time.monotonic()
+    with open(out_path, 'w') as out:
+        rcode = subprocess.call(
+            [sys.executable, '-c', RUNNER, BIN] + args, env=env,
+            stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT
+        )
+    wall = time.monotonic() - start
+    if (rcode != 0) != fails:
+        with open(out_path) as f:
+            tail = f.read().splitlines()[-20:]
+        raise RuntimeError('kubespray %s failed (%d):\n%s'
+                           % (' '.join(args), rcode, '\n'.join(tail)))
+    with open(usage_path) as f:
+        metrics = json.load(f)
+    metrics['wall_s'] = wall
+    return metrics
+
+
+def run_size(size, tasks, port, keep=False):
+    '''Create then deploy a cluster of size hosts'''
+    work = tempfile.mkdtemp(prefix='kubespray-e2e-%d-' % size)
+    try:
+        configfile = os.path.join(work, 'kubespray.yml')
+        with open(configfile, 'w') as f:
+            f.write(CONFIG.format(work=work, port=port))
+        env = environment(work, tasks)
+        nodes = max(size - 6, 1)
+        results = {}
+        results['aws'] = run_cli('aws', [
+            'aws', '--config', configfile, '-y', '--nodes', str(nodes),
+            '--masters', '3', '--etcd', '3'
+        ], env, work)
+        # A node's failures are rescued: the run succeeds
+        rescued = node(work)
+        results['deploy'] = run_cli('deploy', [
+            'deploy', '--config', configfile, '-y', '-u', 'admin'
+        ], dict(env, FAKE_ANSIBLE_RESCUE=rescued), work)
+        check_resume(configfile, env, work)
+        check_failure(configfile, env, work)
+        return results
+    finally:
+        if keep:
+            print('    kept %s' % work)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def node(work):
+    '''The last node of the inventory'''
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    from kubespray.inventory import inventory_format, read_file
+    path = os.path.join(work, 'kubespray', 'inventory', 'inventory.cfg')
+    return read_file(path, inventory_format(path))[0].group_hosts(
+        'kube-node')[-1]
+
+
+def check_resume(configfile, env, work):
+    '''
+    Resuming a run whose stats show no failure (only rescued ones) reruns
+    nothing. Not measured.
+    '''
+    run_cli('resume', [
+        'deploy', '--config', configfile, '-y', '-u', 'admin', '--resume'
+    ], env, work)
+    with open(os.path.join(work, 'resume.out')) as f:
+        out = f.read()
+    if 'nothing to resume' not in out:
+        raise RuntimeError('a successful run is resumed:\n%s'
+                           % '\n'.join(out.splitlines()[-20:]))
+
+
+def check_failure(configfile, env, work):
+    '''
+    A deployment where a node fails prints the last lines of that node,
+    from the coloured Ansible output. Not measured.
+    '''
+    from kubespray.output import TAIL_LINES
+    host = node(work)
+    run_cli('failure', [
+        'deploy', '--config', configfile, '-y', '-u', 'admin'
+    ], dict(env, FAKE_ANSIBLE_FAIL=host), work, fails=True)
+    with open(os.path.join(work, 'failure.out')) as f:
+        out = f.read()
+    dump = out.rpartition('--- last ')[2]
+    if not dump.startswith('%d lines of %s ---' % (TAIL_LINES, host)) or \
+            'fatal: [%s]' % host not in dump:
+        raise RuntimeError('the failed host %s lines are not printed:\n%s'
+                           % (host, '\n'.join(out.splitlines()[-20:])))
+
+
+def check(measured, baseline, tolerance, slack):
+    '''Metrics over baseline * (1 + tolerance) + slack'''
+    return [m for m in METRICS
+            if measured[m] > baseline[m] * (1 + tolerance) + slack[m]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--tasks', type=int,
+                        help=('Tasks per play of the stand-in deployment.'
+                              ' Defaults to the baselines value'))
+    parser.add_argument('--update', action='store_true',
+                        help='Store the results as the new baselines')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the work directories')
+    options = parser.parse_args()
+
+    with open(BASELINES) as f:
+        baselines = json.load(f)
+    if options.tasks is None:
+        options.tasks = baselines['tasks']
+    elif options.tasks != baselines['tasks'] and not options.update:
+        print('The baselines were measured with --tasks %d'
+              % baselines['tasks'])
+        return 1
+    baselines['tasks'] = options.tasks
+    server = BannerServer()
+    port = server.start()
+    failures = 0
+    try:
+        for size in options.sizes:
+            try:
+                results = run_size(size, options.tasks, port, options.keep)
+            except RuntimeError as e:
+                print('%6d hosts: %s' % (size, e))
+                failures += 1
+                continue
+            expected = baselines['sizes'].get(str(size), {})
+            for command, measured in sorted(results.items()):
+                baseline = expected.get(command)
+                over = []
+                if baseline and not options.update:
+                    over = check(measured, baseline, baselines['tolerance'],
+                                 baselines['slack'])
+                failures += bool(over)
+                print('%6d hosts %-7s %8.2fs wall %8.2fs cpu %8.1fMB rss  %s'
+                      % (size, command, measured['wall_s'],
+                         measured['cpu_s'], measured['rss_mb'],
+                         'FAILED: %s' % ', '.join(over) if over else
+                         'updated' if options.update else
+                         'ok' if baseline else 'no baseline'))
+                if options.update:
+                    baselines['sizes'].setdefault(str(size), {})[command] = \
+                        dict((m, round(measured[m], 2)) for m in METRICS)
+    finally:
+        server.stop()
+    if options.update:
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
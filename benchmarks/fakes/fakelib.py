@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Shared code of the stand-in executables (ansible, ansible-playbook, git,
+ssh-agent, ssh-add) used by the benchmarks. Their output only depends on
+their arguments, on ANSIBLE_FORCE_COLOR (coloured result lines, as with
+Ansible) and on the FAKE_* environment variables:
+
+    FAKE_ANSIBLE_TASKS   tasks per play of a deployment playbook (10)
+    FAKE_ANSIBLE_FAIL    hosts failing their last task, comma separated
+    FAKE_ANSIBLE_RESCUE  hosts failing the first task of each play, failures
+                         handled by a rescue section, comma separated
+    FAKE_INSTANCES_BASE  index of the first address given to instances (0)
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+PLAYS = [
+    ('k8s-cluster:etcd', 'bootstrap-os'),
+    ('k8s-cluster:etcd', 'kubernetes/preinstall'),
+    ('etcd', 'etcd'),
+    ('k8s-cluster', 'kubernetes/node'),
+    ('kube-master', 'kubernetes/master'),
+    ('k8s-cluster', 'network_plugin'),
+]
+
+
+def address(index):
+    '''The address of the index-th instance, in 127.0.0.0/8'''
+    return '127.%d.%d.%d' % (
+        1 + index // (254 * 256), (index // 254) % 256, index % 254 + 1)
+
+
+def digest(*parts):
+    return hashlib.sha1(
+        '/'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def option(argv, *names):
+    '''Value of a command line option, None if not given'''
+    for i, arg in enumerate(argv):
+        for name in names:
+            if arg == name and i + 1 < len(argv):
+                return argv[i + 1]
+            if name.startswith('--') and arg.startswith(name + '='):
+                return arg[len(name) + 1:]
+    return None
+
+
+def inventory_hosts(path):
+    '''(hosts in order, {group: [hosts]}) of an inventory file'''
+    from kubespray.inventory import inventory_format, read_file
+    inventory, sections = read_file(path, inventory_format(path))
+    groups = dict((g, list(inventory.group_hosts(g)))
+                  for g in inventory.groups)
+    groups['all'] = list(inventory.hosts)
+    groups['k8s-cluster'] = list(
+        dict.fromkeys(groups.get('kube-master', []) +
+                      groups.get('kube-node', [])))
+    return list(inventory.hosts), groups
+
+
+def select(pattern, groups):
+    '''Hosts of an Ansible host pattern (a:b, comma lists, @file)'''
+    if pattern.startswith('@'):
+        with open(pattern[1:]) as f:
+            pattern = ','.join(line.strip() for line in f if line.strip())
+    known = set(groups['all'])
+    selected = {}
+    for part in pattern.replace(':', ',').split(','):
+        if not part:
+            continue
+        hosts = groups.get(part, [part] if part in known else [])
+        selected.update((h, None) for h in hosts)
+    return list(selected)
+
+
+def limit_hosts(argv, hosts, groups):
+    limit = option(argv, '--limit', '-l')
+    if limit is None:
+        return hosts
+    allowed = set(select(limit, groups))
+    return [h for h in hosts if h in allowed]
+
+
+def facts(host, index):
+    '''Setup module facts of a host, about the size of real ones'''
+    ip = address(index)
+    return {
+        'ansible_hostname': host,
+        'ansible_fqdn': '%s.example.internal' % host,
+        'ansible_nodename': host,
+        'ansible_default_ipv4': {
+            'address': ip, 'interface': 'eth0', 'gateway': '127.0.0.1',
+            'netmask': '255.0.0.0', 'macaddress': '02:00:%s' % ':'.join(
+                digest(host)[i:i + 2] for i in range(0, 8, 2)),
+            'mtu': 9001, 'type': 'ether',
+        },
+        'ansible_all_ipv4_addresses': [ip],
+        'ansible_distribution': 'Ubuntu',
+        'ansible_distribution_version': '16.04',
+        'ansible_distribution_release': 'xenial',
+        'ansible_os_family': 'Debian',
+        'ansible_kernel': '4.4.0-1022-aws',
+        'ansible_architecture': 'x86_64',
+        'ansible_processor_vcpus': 2,
+        'ansible_memtotal_mb': 7983,
+        'ansible_python_version': '2.7.12',
+        'ansible_mounts': [
+            {'mount': '/', 'device': '/dev/xvda1', 'fstype': 'ext4',
+             'size_total': 8309932032, 'size_available': 6203330560},
+        ],
+        'ansible_interfaces': ['lo', 'eth0', 'docker0'],
+        'ansible_env': {
+            'HOME': '/root', 'PATH': '/usr/local/sbin:/usr/local/bin:'
+            '/usr/sbin:/usr/bin:/sbin:/bin', 'SHELL': '/bin/bash',
+        },
+        'ansible_machine_id': digest('machine', host)[:32],
+        'ansible_product_uuid': digest('uuid', host)[:32],
+        'module_setup': True,
+    }
+
+
+class Events(object):
+    '''Events of the kubespray callback plugin, to KUBESPRAY_EVENTS_FD'''
+
+    def __init__(self):
+        self.stream = None
+        fd = os.environ.get('KUBESPRAY_EVENTS_FD')
+        if fd and fd.isdigit():
+            try:
+                self.stream = os.fdopen(int(fd), 'w', 1 << 16)
+            except OSError:
+                self.stream = None
+
+    def emit(self, event, **fields):
+        if self.stream is None:
+            return
+        fields['event'] = event
+        fields['ts'] = time.time()
+        self.stream.write(json.dumps(fields) + '\n')
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+
+# Ansible's colours of the result lines
+COLORS = {'ok': '0;32', 'changed': '0;33', 'fatal': '0;31'}
+
+
+def color(status, line):
+    '''The line in the colour of the status, as with ANSIBLE_FORCE_COLOR'''
+    if os.environ.get('ANSIBLE_FORCE_COLOR', '').lower() not in (
+            '1', 'true', 'yes', 'on'):
+        return line
+    return '\x1b[%sm%s\x1b[0m' % (COLORS[status], line)
+
+
+def output(lines):
+    '''Write lines to stdout in large chunks, like a busy Ansible'''
+    out = sys.stdout
+    out.write('\n'.join(lines))
+    out.write('\n')
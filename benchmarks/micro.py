@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Micro-benchmarks of the CPU-bound code run on every command
+
+Times the inventory reading, formatting and writing, the cloud playbooks
+generation and dumping and the config file parsing on large synthetic
+inputs. Each case runs until it took --min-time seconds (at least --rounds
+times), on fresh state prepared outside of the timing. The best time of
+each case is compared with baselines/micro.json (or with the results of
+another run, --compare) and must not exceed it by more than the threshold
+(plus slack_ms, for the fastest cases).
+
+The times depend on the machine: the results record the time of a fixed
+pure Python loop (calibration_ms) and the reference times are scaled by
+the ratio of the two calibrations. This evens out the CPU speed, not the
+caches or the disks: regenerate the baselines with --update, on the
+machine running the gate, from a clean checkout of the commit measured.
+
+    python benchmarks/micro.py [-k gce] [--output results.json]
+    python benchmarks/micro.py --compare before.json
+    python benchmarks/micro.py --update
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BASELINES = os.path.join(HERE, 'baselines', 'micro.json')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+CASES = []
+
+
+def case(name, params=(None,)):
+    '''
+    Register a benchmark: the decorated function takes a parameter and a
+    work directory and returns (setup, run). setup() prepares the state of
+    a round, run(state) is timed.
+    '''
+    def register(function):
+        for param in params:
+            label = name if param is None else '%s[%s]' % (
+                name, '-'.join(str(p) for p in param)
+                if isinstance(param, tuple) else param)
+            CASES.append((label, function, param))
+        return function
+    return register
+
+
+def base_options(work, **options):
+    result = {
+        'kubespray_path': work,
+        'inventory_path': os.path.join(work, 'inventory', 'inventory.cfg'),
+        'logfile': os.path.join(work, 'kubespray.log'),
+        'loglevel': 'info',
+        'add_node': False,
+        'assume_yes': True,
+        'use_private_ip': False,
+        'assign_public_ip': False,
+    }
+    result.update(options)
+    return result
+
+
+def role_counts(size):
+    return {'masters_count': 3, 'etcds_count': 3,
+            'nodes_count': max(size - 6, 1)}
+
+
+def instances(size):
+    '''Instances lists of the masters, nodes and etcds, as AWS gives them'''
+    records = [{'name': 'k8s-bench-%05d' % i,
+                'public_ip': '10.%d.%d.%d' % (i >> 16, (i >> 8) & 255,
+                                              i & 255),
+                'private_ip': '172.16.%d.%d' % ((i >> 8) & 255, i & 255)}
+               for i in range(size)]
+    return records[:3], records[6:], records[3:6]
+
+
+def inventory_file(work, size):
+    from kubespray.inventory import CfgInventory
+    options = base_options(work, **role_counts(size))
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        CfgInventory(options, 'aws').write_inventory(*instances(size))
+    return options
+
+
+@case('inventory.read_inventory', params=[1000, 10000])
+def read_inventory(size, work):
+    from kubespray import inventory
+    options = inventory_file(work, size)
+
+    def setup():
+        inventory._inventory_cache.clear()
+        return inventory.CfgInventory(options, 'metal')
+    return setup, lambda cfg: cfg.read_inventory()
+
+
+@case('inventory.read_inventory.cached', params=[10000])
+def read_inventory_cached(size, work):
+    from kubespray.inventory import CfgInventory
+    options = inventory_file(work, size)
+    cfg = CfgInventory(options, 'metal')
+    cfg.load()
+    return lambda: cfg, lambda cfg: cfg.read_inventory()
+
+
+@case('inventory.format_inventory', params=[1000, 10000])
+def format_inventory(size, work):
+    from kubespray.inventory import CfgInventory
+    options = base_options(work, cluster_name='bench', **role_counts(size))
+
+    def setup():
+        return CfgInventory(options, 'aws'), instances(size)
+    return setup, lambda state: state[0].format_inventory(*state[1])
+
+
+@case('inventory.write_inventory', params=[(1000, 'ini'), (10000, 'ini'),
+                                           (10000, 'yaml')])
+def write_inventory(param, work):
+    from kubespray.inventory import CfgInventory
+    size, fmt = param
+    options = base_options(work, inventory_format=fmt, **role_counts(size))
+
+    def setup():
+        return CfgInventory(options, 'aws'), instances(size)
+    return setup, lambda state: state[0].write_inventory(*state[1])
+
+
+def cloud_options(work, size, **options):
+    options.update(role_counts(size))
+    return base_options(work, cluster_name='bench', **options)
+
+
+@case('cloud.gen_ec2_playbook', params=[100, 10000])
+def gen_ec2_playbook(size, work):
+    from kubespray.cloud import AWS
+    options = cloud_options(
+        work, size, aws_access_key='key', aws_secret_key='secret',
+        key_name='bench', ami='ami-0bench', region='eu-west-1',
+        security_group_name='bench', masters_instance_type='t2.medium',
+        nodes_instance_type='t2.large', etcds_instance_type='t2.small',
+        tags=['env=bench', 'team=k8s'],
+    )
+    return (lambda: AWS(dict(options)),
+            lambda cloud: cloud.gen_ec2_playbook())
+
+
+@case('cloud.gen_gce_playbook', params=[1000, 10000])
+def gen_gce_playbook(size, work):
+    from kubespray.cloud import GCE
+    options = cloud_options(
+        work, size, image='ubuntu-1604-xenial', zone='europe-west1-b',
+        service_account_email='bench@example.iam.gserviceaccount.com',
+        pem_file='/dev/null', project_id='bench',
+        masters_machine_type='n1-standard-2',
+        nodes_machine_type='n1-standard-4',
+        etcds_machine_type='n1-standard-1', tags=['k8s', 'bench'],
+    )
+    return (lambda: GCE(dict(options)),
+            lambda cloud: cloud.gen_gce_playbook())
+
+
+def openstack_options(work, size, zones):
+    options = cloud_options(
+        work, size, os_auth_url='https://keystone.example:5000/v3',
+        os_username='bench', os_password='bench', os_project_name='bench',
+        os_region_name='RegionOne', network='bench',
+        kube_network='10.42.0.0/16', sshkey='bench', floating_ip=False, image='ubuntu-16.04',
+        masters_flavor='m1.medium', nodes_flavor='m1.large',
+        etcds_flavor='m1.small', masters_volume_size=20,
+        nodes_volume_size=50, etcds_volume_size=10,
+    )
+    if zones:
+        options['os_availability_zones'] = ['zone-%02d' % z
+                                            for z in range(zones)]
+    return options
+
+
+@case('cloud.gen_openstack_playbook', params=[(1000, 0), (10000, 0),
+                                              (10000, 64)])
+def gen_openstack_playbook(param, work):
+    from kubespray.cloud import OpenStack
+    size, zones = param
+    options = openstack_options(work, size, zones)
+    return (lambda: OpenStack(dict(options)),
+            lambda cloud: cloud.gen_openstack_playbook())
+
+
+@case('cloud.write_playbook', params=[1000, 10000])
+def write_playbook(size, work):
+    from kubespray.cloud import OpenStack
+    cloud = OpenStack(openstack_options(work, size, 16))
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        cloud.gen_openstack_playbook()
+    return lambda: cloud, lambda cloud: cloud.write_playbook()
+
+
+def config_file(work, variables):
+    '''The bundled config file, uncommented, with custom group vars'''
+    import yaml
+    template = os.path.join(ROOT, 'src', 'kubespray', 'files',
+                            '.kubespray.yml')
+    with open(template) as f:
+        content = f.read()
+    path = os.path.join(work, 'kubespray.yml')
+    with open(path, 'w') as f:
+        f.write(content)
+        f.write(yaml.safe_dump({'custom_group_vars': {
+            'k8s-cluster': dict(('bench_var_%04d' % i, {
+                'enabled': bool(i % 2), 'value': 'x' * (i % 40),
+                'items': list(range(i % 8))}) for i in range(variables)),
+        }}, default_flow_style=False))
+    return path
+
+
+@case('config.parse_configfile', params=[10, 1000])
+def parse_configfile(variables, work):
+    from kubespray.configure import Config
+    path = config_file(work, variables)
+    return lambda: Config(path), lambda config: config.parse_configfile
+
+
+@case('config.default_values')
+def default_values(param, work):
+    import argparse
+    from kubespray.configure import Config
+    path = config_file(work, 10)
+    args = argparse.Namespace(
+        subparser_name='aws', kubespray_path=None, inventory_path=None,
+        configfile=path, assume_yes=True, noclone=False, add_node=False,
+        masters_count=3, nodes_count=100, etcds_count=3,
+        masters_instance_type=None, nodes_instance_type=None,
+        etcds_instance_type=None, security_group_name=None,
+        security_group_id=None, use_private_ip=None, assign_public_ip=None,
+    )
+    config = Config(path)
+    content = config.parse_configfile
+
+    def setup():
+        return dict(content)
+    return setup, lambda values: config.default_values(args, values)
+
+
+def checksums_tree(work, versions):
+    '''A kubespray checkout whose checksums file lists versions per arch'''
+    import yaml
+    path = os.path.join(work, 'roles', 'kubespray-defaults', 'defaults',
+                        'main', 'checksums.yml')
+    os.makedirs(os.path.dirname(path))
+    os.makedirs(os.path.join(work, '.git'))
+    with open(os.path.join(work, '.git', 'HEAD'), 'w') as f:
+        f.write('%040x\n' % versions)
+    checksums = dict(('v1.%d.%d' % (i // 20, i % 20), '%064x' % i)
+                     for i in range(versions))
+    with open(path, 'w') as f:
+        yaml.safe_dump({'%s_checksums' % binary: dict(
+            (arch, checksums) for arch in ['amd64', 'arm64', 'arm', 'ppc64le'])
+            for binary in ['kubelet', 'kubectl', 'kubeadm']}, f,
+            default_flow_style=False)
+    return base_options(work, yaml_cache=False)
+
+
+@case('versions.build', params=[500])
+def versions_build(versions, work):
+    from kubespray import yamlio
+    from kubespray.versions import VersionIndex
+    options = checksums_tree(work, versions)
+
+    def setup():
+        yamlio._documents.clear()
+        return VersionIndex(options)
+    return setup, lambda index: index.versions(refresh=True)
+
+
+@case('versions.indexed', params=[500])
+def versions_indexed(versions, work):
+    from kubespray.versions import VersionIndex
+    options = checksums_tree(work, versions)
+    VersionIndex(options).versions()
+    return (lambda: VersionIndex(options),
+            lambda index: 'v1.0.1' in index)
+
+
+def playbook_output(hosts, tasks):
+    '''Lines of the default Ansible output of a run'''
+    lines = []
+    for task in range(tasks):
+        lines.append('TASK [role : task %d] %s' % (task, '*' * 60))
+        lines.extend('%s: [k8s-bench-%05d]' % (
+            'changed' if (host + task) % 3 == 0 else 'ok', host)
+            for host in range(hosts))
+    return lines
+
+
+@case('output.pipeline', params=[1000])
+def output_pipeline(hosts, work):
+    from kubespray import output
+    lines = playbook_output(hosts, 20)
+
+    def setup():
+        return output.OutputPipeline([
+            output.TerminalQueue(stream=open(os.devnull, 'w')),
+            output.HostTail(),
+            output.CompressedLog(os.path.join(work, 'output.log.gz')),
+        ])
+
+    def run(pipeline):
+        for start in range(0, len(lines), 1000):
+            for line in lines[start:start + 1000]:
+                pipeline(line)
+            pipeline.flush()
+        pipeline.close()
+    return setup, run
+
+
+def measure(setup, run, rounds, min_time):
+    '''Times of run(setup()), at least rounds times and min_time seconds'''
+    run(setup())
+    times = []
+    total = 0
+    while len(times) < rounds or total < min_time:
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+        if len(times) >= 1000:
+            break
+    times.sort()
+    return {
+        'min_ms': round(times[0] * 1000, 3),
+        'median_ms': round(times[len(times) // 2] * 1000, 3),
+        'rounds': len(times),
+    }
+
+
+def calibrate(rounds, min_time):
+    '''Best time of a fixed pure Python loop, in ms'''
+    def loop(state):
+        counts = {}
+        for i in range(100000):
+            key = 'host-%d' % (i % 64)
+            counts[key] = counts.get(key, 0) + len(key)
+        return counts
+    return measure(lambda: None, loop, rounds, min_time)['min_ms']
+
+
+def commit():
+    '''The commit measured, "-dirty" when the tree has local changes'''
+    try:
+        head = subprocess.check_output(
+            ['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+        changes = subprocess.check_output(
+            ['git', '-C', ROOT, 'status', '--porcelain',
+             '--untracked-files=no'],
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head + '-dirty' if changes else head
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('-k', dest='keyword',
+                        help='Only run the cases whose name contains it')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.5)
+    parser.add_argument('--output', help='Write the results to this file')
+    parser.add_argument('--compare', default=BASELINES,
+                        help='Results to compare with. Default: %(default)s')
+    parser.add_argument('--threshold', type=float,
+                        help=('Maximum slowdown, 0.25 is 25%%. Defaults to'
+                              ' the baselines threshold'))
+    parser.add_argument('--update', action='store_true',
+                        help='Store the results as the new baselines')
+    options = parser.parse_args()
+    if options.update and options.keyword:
+        parser.error('--update measures every case, without -k')
+
+    with open(BASELINES) as f:
+        baselines = json.load(f)
+    with open(options.compare) as f:
+        reference = json.load(f)
+    threshold = options.threshold
+    if threshold is None:
+        threshold = baselines['threshold']
+    calibration = calibrate(options.rounds, options.min_time)
+    # How much slower this machine is than the reference one
+    scale = calibration / reference.get('calibration_ms', calibration)
+    print('%-44s %10.2fms  x%.2f' % ('calibration', calibration, scale))
+    reference = reference['results']
+
+    results = {}
+    failures = 0
+    for name, function, param in CASES:
+        if options.keyword and options.keyword not in name:
+            continue
+        work = tempfile.mkdtemp(prefix='kubespray-micro-')
+        try:
+            os.makedirs(os.path.join(work, 'inventory'))
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                setup, run = function(param, work)
+                result = measure(setup, run, options.rounds,
+                                 options.min_time)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        results[name] = result
+        before = reference.get(name)
+        status = 'no reference'
+        if before:
+            expected = before['min_ms'] * scale
+            ratio = result['min_ms'] / expected
+            status = '%+.0f%%' % ((ratio - 1) * 100)
+            limit = expected * (1 + threshold) + baselines['slack_ms']
+            if result['min_ms'] > limit and not options.update:
+                status += ' FAILED'
+                failures += 1
+        print('%-44s %10.2fms %10.2fms %5d  %s' % (
+            name, result['min_ms'], result['median_ms'], result['rounds'],
+            status))
+
+    document = {
+        'calibration_ms': calibration,
+        'commit': commit(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if options.update:
+        baselines.update(document)
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Native provisioning engine check
+
+Runs ``kubespray aws`` with the generated playbook (the ansible-playbook
+stand-in of benchmarks/fakes) and with ``--engine native`` on libcloud's
+dummy driver, then checks that both write the same inventory: the same
+groups with the same number of hosts, named after the cluster, with the
+same variables. Only the cluster name of the hosts is compared, their
+suffixes are random and their addresses given by each cloud.
+
+    python benchmarks/native.py [--nodes 4 10]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from e2e import CONFIG, BannerServer, environment, run_cli
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+NODES = [4, 10]
+
+
+def create(engine, nodes, port):
+    '''Run kubespray aws with the engine, returns the inventory'''
+    sys.path.insert(0, os.path.join(ROOT, 'src'))
+    from kubespray.inventory import inventory_format, read_file
+    work = tempfile.mkdtemp(prefix='kubespray-native-%s-' % engine)
+    try:
+        configfile = os.path.join(work, 'kubespray.yml')
+        with open(configfile, 'w') as f:
+            f.write(CONFIG.format(work=work, port=port))
+            f.write('native_driver: dummy\ncluster_name_seed: native\n')
+        run_cli('aws', [
+            'aws', '--config', configfile, '-y', '--nodes', str(nodes),
+            '--masters', '3', '--etcd', '3', '--engine', engine
+        ], environment(work, 1), work)
+        path = os.path.join(work, 'kubespray', 'inventory', 'inventory.cfg')
+        return read_file(path, inventory_format(path))[0]
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def shape(inventory):
+    '''What both engines must agree on'''
+    return {
+        'groups': dict((g, len(inventory.group_hosts(g)))
+                       for g in inventory.groups),
+        'hosts': len(inventory),
+        'clusters': sorted(set(h.name.rsplit('-', 1)[0]
+                               for h in inventory)),
+        'variables': sorted(set(tuple(sorted(h.hostvars))
+                                for h in inventory)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--nodes', type=int, nargs='+', default=NODES)
+    options = parser.parse_args()
+
+    server = BannerServer()
+    port = server.start()
+    failures = 0
+    try:
+        for nodes in options.nodes:
+            try:
+                shapes = dict((engine, shape(create(engine, nodes, port)))
+                              for engine in ('ansible', 'native'))
+            except RuntimeError as e:
+                print('%6d nodes: %s' % (nodes, e))
+                failures += 1
+                continue
+            differences = [key for key in sorted(shapes['ansible'])
+                           if shapes['ansible'][key] != shapes['native'][key]]
+            failures += bool(differences)
+            print('%6d nodes %3d hosts  %s' % (
+                nodes, shapes['native']['hosts'],
+                'FAILED: %s' % '; '.join(
+                    '%s ansible=%r native=%r' % (
+                        key, shapes['ansible'][key], shapes['native'][key])
+                    for key in differences)
+                if differences else 'same inventory'))
+    finally:
+        server.stop()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+CLI startup benchmark
+
+Runs bin/kubespray under ``python -X importtime`` and checks, for each
+command of baselines/startup.json, that the time spent importing modules
+(on top of the bare interpreter startup) stays under its budget and that
+none of the forbidden modules gets imported. Commands starting with
+"import " check the import of a kubespray module instead.
+
+    python benchmarks/startup.py [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BIN = os.path.join(ROOT, 'bin', 'kubespray')
+BUDGETS = os.path.join(HERE, 'baselines', 'startup.json')
+
+
+def import_times(args):
+    '''
+    Run python -X importtime and return ({module: self time in us}, total)
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.join(ROOT, 'src')] +
+        [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p]
+    )
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime'] + args, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(self_us)
+    return modules, sum(modules.values())
+
+
+def best_of(args, repeat):
+    runs = [import_times(args) for _ in range(repeat)]
+    return min(runs, key=lambda r: r[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    with open(BUDGETS) as f:
+        budgets = json.load(f)['commands']
+
+    interpreter, interpreter_us = best_of(['-c', 'pass'], options.repeat)
+    failures = 0
+    for command, budget in sorted(budgets.items()):
+        if command.startswith('import '):
+            args = ['-c', command]
+        else:
+            args = [BIN] + command.split()
+        modules, total_us = best_of(args, options.repeat)
+        cli_ms = (total_us - interpreter_us) / 1000.0
+        forbidden = sorted(
+            m for m in modules for f in budget.get('forbidden', [])
+            if m == f or m.startswith(f + '.')
+        )
+        ok = cli_ms <= budget['budget_ms'] and not forbidden
+        failures += not ok
+        print('%-26s %7.1fms (budget %sms) %s' % (
+            command, cli_ms, budget['budget_ms'], 'ok' if ok else 'FAILED'))
+        if forbidden:
+            print('    imports %s' % ', '.join(forbidden[:10]))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,7 +8,6 @@ requirements = [
     'cffi>=1.6.0',
     'setuptools>=11.3',
     'cryptography>=1.3.2',
-    'requests>=2.4.3',
     'netaddr>=0.7.18',
     'markupsafe>=0.23',
     'pyasn1>=0.1.8',
@@ -38,7 +37,11 @@ setup(
         'bin/kubespray'
     ],
     package_dir={'': 'src'},
-    package_data={'kubespray': ['files/*.yml'], },
+    package_data={
+        'kubespray': [
+            'files/*.yml', 'files/*.gz', 'files/callback_plugins/*.py'
+        ],
+    },
     install_requires=requirements,
     license="GPLv3",
     zip_safe=False,
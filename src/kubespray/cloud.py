@@ -26,19 +26,24 @@ import json
 import os
 import shutil
 import sys
-import yaml
+import time
 
-from kubespray.inventory import CfgInventory
-from kubespray.common import (get_logger, query_yes_no, run_command, which,
-                              id_generator, get_cluster_name)
-from ansible.utils.display import Display
+from collections import OrderedDict
+from kubespray import yamlio
+from kubespray.fileutil import write_atomic
+from kubespray.inventory import CfgInventory, instance_name
+from kubespray.common import (display, get_logger, query_yes_no, run_command,
+                              which, id_generator)
 
+# Provisioning API calls running at the same time and how long to wait
+# for them, see Cloud.async_provisioning
+PROVISION_CONCURRENCY = 10
+PROVISION_TIMEOUT = 1800
+PROVISION_POLL = 5
 
-noalias_dumper = yaml.dumper.SafeDumper
-noalias_dumper.ignore_aliases = lambda self, data: True
 
-display = Display()
-playbook_exec = which('ansible-playbook')
+def playbook_exec():
+    return which('ansible-playbook')
 
 
 def chunks(l, n):
@@ -122,6 +127,69 @@ class Cloud(object):
             self.options
         )
 
+    def async_provisioning(self, prefix, launches):
+        '''
+        Add the tasks creating the instances of all the roles at once: the
+        provisioning tasks are started in the background (async, poll: 0),
+        at most provision_concurrency API calls at a time (a task with a
+        loop makes one call per item), then joined with async_status.
+        Afterwards <prefix>_<role> holds the result of each role, as the
+        synchronous task would have registered it.
+
+        launches: [(role, task)], the tasks without register
+        '''
+        concurrency = int(self.options.get(
+            'provision_concurrency', PROVISION_CONCURRENCY))
+        timeout = int(self.options.get('provision_timeout', PROVISION_TIMEOUT))
+        templates = OrderedDict(launches)
+        calls = []
+        for role, task in launches:
+            if 'loop' in task:
+                calls.extend((role, item) for item in task['loop'])
+            else:
+                calls.append((role, None))
+        tasks = self.pbook_content[0]['tasks']
+        joined = OrderedDict((role, []) for role in templates)
+        for wave, wave_calls in enumerate(chunks(calls, concurrency)):
+            jobs = []
+            for role, template in templates.items():
+                items = [item for r, item in wave_calls if r == role]
+                if not items:
+                    continue
+                job = '%s_%s_job%d' % (prefix, role, wave)
+                task = dict(template)
+                task.update({'register': job, 'async': timeout, 'poll': 0})
+                if 'loop' in template:
+                    task['loop'] = items
+                tasks.append(task)
+                jobs.append((role, job, 'loop' in template))
+            for role, job, looped in jobs:
+                result = '%s_%s_%d' % (prefix, role, wave)
+                join = {
+                    'name': 'Wait for: %s' % templates[role]['name'],
+                    'async_status': {
+                        'jid': '{{ %s.ansible_job_id }}' % (
+                            'item' if looped else job)
+                    },
+                    'register': result,
+                    'until': '%s.finished' % result,
+                    'retries': timeout // PROVISION_POLL,
+                    'delay': PROVISION_POLL,
+                }
+                if looped:
+                    join['loop'] = '{{ %s.results }}' % job
+                tasks.append(join)
+                joined[role].append(result)
+        facts = {}
+        for role, results in joined.items():
+            if 'loop' in templates[role]:
+                facts['%s_%s' % (prefix, role)] = {'results': '{{ %s }}' % (
+                    ' + '.join('%s.results' % r for r in results))}
+            else:
+                facts['%s_%s' % (prefix, role)] = '{{ %s }}' % results[0]
+        tasks.append({'name': 'Gather the %s results' % prefix,
+                      'set_fact': facts})
+
     def write_local_inventory(self):
         '''Generates inventory for local tasks'''
         self.cparser.add_section('local')
@@ -141,8 +209,7 @@ class Cloud(object):
         try:
             with open(self.playbook, "w") as pb:
                 pb.write(
-                    yaml.dump(self.pbook_content, default_flow_style=False,
-                              Dumper=noalias_dumper)
+                    yamlio.dump(self.pbook_content, default_flow_style=False)
                 )
         except IOError as e:
             display.error(
@@ -150,51 +217,174 @@ class Cloud(object):
             )
             sys.exit(1)
 
-    def write_inventory(self):
-        '''Generate the inventory according the instances created'''
+    def load_instances(self):
+        '''Read the instances lists written by the playbook'''
         for role in ['masters', 'nodes', 'etcds']:
+            if self.instances[role]['json'] is not None:
+                continue
             if '%s_count' % role in list(self.options.keys()):
-                with open(self.instances['%s' % role]['file']) as f:
-                    self.instances['%s' % role]['json'] = json.load(f)
+                try:
+                    with open(self.instances['%s' % role]['file']) as f:
+                        self.instances['%s' % role]['json'] = json.load(f)
+                except (IOError, ValueError) as e:
+                    display.error('Cannot read the instances list %s: %s'
+                                  % (self.instances[role]['file'], e))
+                    sys.exit(1)
             else:
                 self.instances['%s' % role]['json'] = []
 
+    def instance_address(self, instance):
+        '''(name, address) of an instance of the instances lists'''
+        if self.options['use_private_ip']:
+            address = instance['private_ip']
+        else:
+            address = instance['public_ip']
+        return instance.get('name', instance.get('id', address)), address
+
+    def wait_for_ssh(self):
+        '''
+        Wait until the SSH server of every instance created answers, all
+        the instances at the same time
+        '''
+        from kubespray.probe import format_wait_results, wait_hosts
+        self.load_instances()
+        port = int(self.options.get('ssh_port', 22))
+        targets = []
+        for role in ['masters', 'nodes', 'etcds']:
+            for instance in self.instances[role]['json']:
+                name, address = self.instance_address(instance)
+                targets.append((name, address, port))
+        if not targets:
+            return
+        display.banner('WAITING FOR SSH')
+        deadline = float(self.options.get('ssh_wait_timeout', 600))
+        start = time.time()
+        results = wait_hosts(
+            targets, deadline=deadline,
+            concurrency=int(self.options.get('probe_concurrency', 200)),
+            timeout=float(self.options.get('probe_timeout', 10))
+        )
+        lines = format_wait_results(results)
+        for line in lines[:11]:
+            display.display(line)
+        if len(lines) > 11:
+            display.display('... %d more hosts' % (len(lines) - 11))
+        self.logger.info('SSH readiness: %s' % '; '.join(
+            '%s %s' % (r.host, '%.1fs' % r.ready_after if r.ok else r.error)
+            for r in results))
+        failed = [r.host for r in results if not r.ok]
+        if failed:
+            self.logger.critical(
+                'SSH is not available after %ss on: %s'
+                % (deadline, ', '.join(failed)))
+            sys.exit(1)
+        display.display('%d instances ready in %.1fs' % (
+            len(results), time.time() - start), color='green')
+
+    def write_inventory(self):
+        '''Generate the inventory according the instances created'''
+        self.load_instances()
+
         self.Cfg.write_inventory(
             self.instances['masters']['json'],
             self.instances['nodes']['json'],
             self.instances['etcds']['json'],
         )
 
+    def role_counts(self):
+        '''Number of instances to create per role'''
+        counts = OrderedDict()
+        for role in ['masters', 'nodes', 'etcds']:
+            if '%s_count' % role in list(self.options.keys()):
+                counts[role] = self.options['%s_count' % role]
+        return counts
+
+    def cluster_name(self):
+        '''The cluster name the instances are named after'''
+        if self.options['add_node']:
+            return self.Cfg.cluster_name
+        elif 'cluster_name' in list(self.options.keys()):
+            return self.options['cluster_name']
+        else:
+            return self.Cfg.new_cluster_name()
+
+    def confirm_creation(self):
+        if self.options['assume_yes']:
+            return
+        count = sum(self.role_counts().values())
+        if self.options['add_node']:
+            display.warning(
+                '%s node(s) will be added to the current inventory %s' %
+                (count, self.inventorycfg)
+            )
+        if not query_yes_no(
+            'Create %s instances on %s ?' % (count, self.cloud)
+        ):
+            display.display('Aborted', color='red')
+            sys.exit(1)
+
+    def create_instances_native(self):
+        '''
+        Create the instances through the cloud API directly, without
+        ansible-playbook, and write the instances lists
+        '''
+        from kubespray.provision import ProvisionError, provision
+        self.confirm_creation()
+        counts = self.role_counts()
+        display.banner('CREATE %s INSTANCES' % self.cloud.upper())
+        start = time.time()
+        # As with the playbook: the inventory names the EC2 instances after
+        # its own cluster name, the GCE ones are named after the option
+        if self.cloud == 'aws' and not self.options['add_node']:
+            cluster_name = self.Cfg.new_cluster_name()
+        else:
+            cluster_name = self.cluster_name()
+        try:
+            instances = provision(
+                self.options, self.cloud, cluster_name, counts)
+        except ProvisionError as e:
+            if e.nodes:
+                self.logger.warning(
+                    'Instances created before the failure: %s'
+                    % ', '.join(e.nodes))
+            if e.left:
+                self.logger.critical(
+                    'Instances which could not be destroyed, delete them:'
+                    ' %s' % ', '.join(e.left))
+            self.logger.critical('Cannot create instances: %s' % e)
+            sys.exit(1)
+        for role, records in instances.items():
+            try:
+                write_atomic(self.instances[role]['file'],
+                             [json.dumps(records, indent=2)])
+            except (IOError, OSError) as e:
+                display.error('Cannot write the instances list %s: %s'
+                              % (self.instances[role]['file'], e))
+                sys.exit(1)
+            self.instances[role]['json'] = records
+        display.display('%d instances created in %.1fs' % (
+            sum(counts.values()), time.time() - start), color='green')
+
     def create_instances(self):
         '''Run ansible-playbook for instances creation'''
         cmd = [
-            playbook_exec,
+            playbook_exec(),
             '-i',
             self.localcfg,
             '-e',
             'ansible_connection=local',
             self.playbook,
         ]
-        if self.options['ansible_opts']:
+        if self.options.get('ansible_opts'):
             cmd = cmd + self.options['ansible_opts']
-        if not self.options['assume_yes']:
-            count = 0
-            for role in ['masters', 'nodes', 'etcds']:
-                if '%s_count' % role in list(self.options.keys()):
-                    count = count + self.options['%s_count' % role]
-            if self.options['add_node']:
-                display.warning(
-                    '%s node(s) will be added to the current inventory %s' %
-                    (count, self.inventorycfg)
-                )
-            if not query_yes_no(
-                'Create %s instances on %s ?' % (count, self.cloud)
-            ):
-                display.display('Aborted', color='red')
-                sys.exit(1)
+        self.confirm_creation()
 
         display.display(" ".join(cmd))
-        rcode, emsg = run_command('Create %s instances' % self.cloud, cmd)
+        rcode, emsg = run_command(
+            'Create %s instances' % self.cloud, cmd,
+            timeout=self.options.get('command_timeout'),
+            idle_timeout=self.options.get('command_idle_timeout')
+        )
         if rcode != 0:
             self.logger.critical('Cannot create instances: %s' % emsg)
             sys.exit(1)
@@ -214,13 +404,12 @@ class Cloud(object):
             config_path = os.path.join(group_vars_path, name) + '.yml'
             shutil.copy(config_path, config_path + ".orig")
 
-            config = yaml.load(open(config_path, 'r'))
+            config = yamlio.read(config_path)
             config.update(values)
 
             with open(config_path, 'w') as new_config:
                 new_config.write(
-                    yaml.dump(config, default_flow_style=False,
-                              Dumper=noalias_dumper))
+                    yamlio.dump(config, default_flow_style=False))
 
             display.display(
                 'Group vars updated: %s' % config_path, color='green')
@@ -263,12 +452,13 @@ class AWS(Cloud):
             'region',
         ]
         # Define EC2 task
+        launches = []
+        followups = []
         for role in ['masters', 'nodes', 'etcds']:
             if '%s_count' % role in list(self.options.keys()):
                 ec2_task = {
                     'ec2': {},
                     'name': 'Provision EC2 %s instances' % role,
-                    'register': 'ec2_%s' % role,
                 }
                 for opt in ec2_options:
                     if opt in list(self.options.keys()):
@@ -280,17 +470,18 @@ class AWS(Cloud):
                 ec2_task['ec2'].update(
                     {'instance_type': self.options['%s_instance_type' % role]}
                 )
-                ec2_task['ec2'].update(
-                    {
-                        'instance_profile_name': self.options[
-                            '%s_instance_profile_name' % role
-                        ]
-                    }
-                )
+                if '%s_instance_profile_name' % role in self.options:
+                    ec2_task['ec2'].update(
+                        {
+                            'instance_profile_name': self.options[
+                                '%s_instance_profile_name' % role
+                            ]
+                        }
+                    )
                 ec2_task['ec2'].update({'wait': True})
-                self.pbook_content[0]['tasks'].append(ec2_task)
+                launches.append((role, ec2_task))
                 # Write ec2 instances json
-                self.pbook_content[0]['tasks'].append(
+                followups.append(
                     {
                         'name': 'Generate a file with ec2 instances list',
                         'copy': {
@@ -299,24 +490,8 @@ class AWS(Cloud):
                         },
                     }
                 )
-                # Wait for ssh task
-                if self.options['use_private_ip']:
-                    instance_ip = '{{ item.private_ip }}'
-                else:
-                    instance_ip = '{{ item.public_ip }}'
-                self.pbook_content[0]['tasks'].append(
-                    {
-                        'local_action': {
-                            'host': '%s' % instance_ip,
-                            'module': 'wait_for',
-                            'port': 22,
-                            'state': 'started',
-                            'timeout': 600,
-                        },
-                        'name': 'Wait until SSH is available',
-                        'with_items': '{{ec2_%s.instances}}' % role,
-                    }
-                )
+        self.async_provisioning('ec2', launches)
+        self.pbook_content[0]['tasks'].extend(followups)
 
         self.write_local_inventory()
         self.write_playbook()
@@ -349,41 +524,21 @@ class GCE(Cloud):
             'subnetwork',
         ]
         # Define instance names
-        cluster_name = 'k8s-' + get_cluster_name()
+        cluster_name = self.cluster_name()
+        launches = []
+        followups = []
         for role in ['masters', 'nodes', 'etcds']:
             gce_instance_names = list()
             if '%s_count' % role in list(self.options.keys()):
                 for x in range(self.options['%s_count' % role]):
-                    if self.options['add_node']:
-                        current_inventory = self.Cfg.read_inventory()
-                        cluster_name = '-'.join(
-                            current_inventory['all']['hosts'][0][
-                                'hostname'
-                            ].split(
-                                '-'
-                            )[
-                                :-2
-                            ]
-                        )
-                        gce_instance_names.append(
-                            cluster_name + '-%s' % id_generator()
-                        )
-                    elif 'cluster_name' in list(self.options.keys()):
-                        gce_instance_names.append(
-                            self.options['cluster_name'] +
-                            '-%s' %
-                            id_generator()
-                        )
-                    else:
-                        gce_instance_names.append(
-                            cluster_name + '-%s' % id_generator()
-                        )
+                    gce_instance_names.append(
+                        cluster_name + '-%s' % id_generator()
+                    )
                 gce_instance_names = ','.join(gce_instance_names)
                 # Define GCE task
                 gce_task = {
                     'gce': {},
                     'name': 'Provision GCE %s instances' % role,
-                    'register': 'gce_%s' % role,
                 }
                 for opt in gce_options:
                     if opt in list(self.options.keys()):
@@ -395,9 +550,9 @@ class GCE(Cloud):
                 gce_task['gce'].update(
                     {'instance_names': '%s' % gce_instance_names}
                 )
-                self.pbook_content[0]['tasks'].append(gce_task)
+                launches.append((role, gce_task))
                 # Write gce instances json
-                self.pbook_content[0]['tasks'].append(
+                followups.append(
                     {
                         'name': 'Generate a file with %s list' % role,
                         'copy': {
@@ -406,25 +561,8 @@ class GCE(Cloud):
                         },
                     }
                 )
-                # Wait for ssh task
-                if self.options['use_private_ip']:
-                    instance_ip = '{{ item.private_ip }}'
-                else:
-                    instance_ip = '{{ item.public_ip }}'
-
-                self.pbook_content[0]['tasks'].append(
-                    {
-                        'local_action': {
-                            'host': '%s' % instance_ip,
-                            'module': 'wait_for',
-                            'port': 22,
-                            'state': 'started',
-                            'timeout': 600,
-                        },
-                        'name': 'Wait until SSH is available',
-                        'with_items': '{{gce_%s.instance_data}}' % role,
-                    }
-                )
+        self.async_provisioning('gce', launches)
+        self.pbook_content[0]['tasks'].extend(followups)
         self.write_local_inventory()
         self.write_playbook()
 
@@ -438,6 +576,13 @@ class OpenStack(Cloud):
     def gen_cloud_playbook(self):
         self.gen_openstack_playbook()
 
+    def instance_address(self, instance):
+        if self.options['floating_ip']:
+            address = instance['openstack']['public_v4']
+        else:
+            address = instance['openstack']['private_v4']
+        return instance_name(instance), address
+
     def gen_openstack_playbook(self):
 
         openstack_credential_args = (
@@ -466,14 +611,11 @@ class OpenStack(Cloud):
                 {'domain_name': self.options['os_domain_name']}
             )
 
-        if self.options['floating_ip']:
-            ip_type = 'public'
-        else:
-            ip_type = 'private'
-
         # Define instance names
         cluster_name = 'k8s-' + self.options['cluster_name']
         os_security_group_name = cluster_name + '-%s' % id_generator()
+        if self.options['add_node']:
+            cluster_name = self.Cfg.cluster_name
 
         self.pbook_content[0]['tasks'].append(
             {
@@ -506,29 +648,18 @@ class OpenStack(Cloud):
             }
         )
 
+        port_launches = []
+        launches = []
+        followups = []
         for role in ('masters', 'nodes', 'etcds'):
             os_instance_names = list()
             if '%s_count' % role in list(self.options.keys()):
                 for x in range(self.options['%s_count' % role]):
-                    if self.options['add_node']:
-                        current_inventory = self.Cfg.read_inventory()
-                        cluster_name = '-'.join(
-                            current_inventory['all']['hosts'][0][
-                                'hostname'
-                            ].split(
-                                '-'
-                            )[
-                                :-1
-                            ]
-                        )
-                        os_instance_names.append(
-                            cluster_name + '-%s' % id_generator()
-                        )
-                    else:
-                        os_instance_names.append(
-                            cluster_name + '-%s' % id_generator()
-                        )
-                self.pbook_content[0]['tasks'].append(
+                    os_instance_names.append(
+                        cluster_name + '-%s' % id_generator()
+                    )
+                port_launches.append((
+                    role,
                     {
                         'name': 'Create %s network ports' % role,
                         'os_port': {
@@ -545,9 +676,9 @@ class OpenStack(Cloud):
                             'security_groups': [os_security_group_name],
                             'state': 'present',
                         },
-                        'with_items': os_instance_names,
+                        'loop': os_instance_names,
                     }
-                )
+                ))
 
                 host_zones = None
                 if self.options.get("os_availability_zones"):
@@ -576,7 +707,6 @@ class OpenStack(Cloud):
 
                 provision_item = {
                     "name": 'Provision OS %s instances' % role,
-                    "register": 'os_%s' % role,
                     }
 
                 net_id = self.options.get('os_network_id')
@@ -604,19 +734,18 @@ class OpenStack(Cloud):
                             'userdata': self.options.get("userdata", "")
                            }
 
+                provision_item["os_server"] = os_server_item
                 if host_zones:
                     os_server_item["availability_zone"] = "{{item.zone}}"
-
-                    provision_item["os_server"] = os_server_item
                     provision_item["loop"] = host_zones
                 else:
                     provision_item["loop"] = [
                         {"name": name} for name in os_instance_names]
 
-                self.pbook_content[0]['tasks'].append(provision_item)
+                launches.append((role, provision_item))
 
                 # Write os instances json
-                self.pbook_content[0]['tasks'].append(
+                followups.append(
                     {
                         'name': 'Generate a file with OS %s instances list' %
                         role,
@@ -626,19 +755,9 @@ class OpenStack(Cloud):
                         },
                     }
                 )
-                # Wait for ssh task
-                self.pbook_content[0]['tasks'].append(
-                    {
-                        'name': 'Wait until SSH is available',
-                        'wait_for': {
-                            'host': '{{item.openstack.%s_v4}}' % ip_type,
-                            'port': 22,
-                            'search_regex': 'SSH',
-                            'state': 'started',
-                            'delay': 10,
-                        },
-                        'with_items': '{{os_%s.results}}' % role,
-                    }
-                )
+        # The ports must exist before the servers using them
+        self.async_provisioning('os_port', port_launches)
+        self.async_provisioning('os', launches)
+        self.pbook_content[0]['tasks'].extend(followups)
         self.write_local_inventory()
         self.write_playbook()
@@ -17,22 +17,40 @@
 #    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
 
 import getpass
-import logging
+import gzip
 import shutil
-import requests
 import random
 import os
 import re
-import netaddr
 import sys
 import string
 
+from functools import lru_cache
 from shutil import which
+from subprocess import DEVNULL, call
 
-from ansible.utils.display import Display
-from subprocess import PIPE, STDOUT, Popen, CalledProcessError
+from kubespray.logger import setup_logging
+from kubespray.process import ProcessRunner, CommandTimeout
 
-display = Display()
+
+@lru_cache(maxsize=None)
+def ansible_display():
+    '''Ansible's Display, created on the first message'''
+    from ansible.utils.display import Display
+    return Display()
+
+
+class LazyDisplay(object):
+    '''
+    Forwards to ansible_display(): the commands which print nothing do not
+    import ansible
+    '''
+
+    def __getattr__(self, name):
+        return getattr(ansible_display(), name)
+
+
+display = LazyDisplay()
 
 
 def read_password():
@@ -71,27 +89,41 @@ def query_yes_no(question, default="yes"):
 
 
 def get_logger(logfile, loglevel):
-    logger = logging.getLogger()
-    handler = logging.FileHandler(logfile)
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(getattr(logging, loglevel.upper()))
-    return logger
+    '''
+    The root logger, set up on the first call only
+    '''
+    return setup_logging(logfile, loglevel)
 
 
-def get_cluster_name():
-    try:
-        word_site = ("http://svnweb.freebsd.org/csrg/share/dict/"
-                     "words?view=co&content-type=text/plain")
-        response = requests.get(word_site)
-        words = response.content.splitlines()
-        cluster_name = random.choice(words).decode("utf-8")
-    except requests.exceptions.RequestException:
-        cluster_name = id_generator()
-    if not re.match('^(?:[a-z](?:[-a-z0-9]{0,61}[a-z0-9])?)$', cluster_name):
-        get_cluster_name()
-    return(cluster_name.lower())
+CLUSTER_NAME_RE = re.compile('^(?:[a-z](?:[-a-z0-9]{0,61}[a-z0-9])?)$')
+WORDS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'files', 'words.txt.gz'
+)
+
+
+@lru_cache(maxsize=None)
+def load_words():
+    '''
+    The bundled word list used for cluster names, read once per process
+    '''
+    with gzip.open(WORDS_FILE, 'rt') as f:
+        return tuple(w for w in f.read().split() if CLUSTER_NAME_RE.match(w))
+
+
+def get_cluster_name(seed=None, existing=()):
+    '''
+    Pick a cluster name from the bundled word list, avoiding the names
+    in existing. The choice is deterministic for a given seed.
+    '''
+    rng = random.Random(seed)
+    existing = set(existing)
+    words = [w for w in load_words() if w not in existing]
+    if words:
+        return rng.choice(words)
+    while True:
+        cluster_name = 'k' + id_generator(rng=rng)
+        if cluster_name not in existing:
+            return cluster_name
 
 
 def clone_kubespray_git_repo(options):
@@ -111,56 +143,146 @@ def clone_kubespray_git_repo(options):
             clone_git_repo(
                 'kubespray', options['kubespray_path'],
                 options['kubespray_git_repo'],
-                options.get('kubespray_tag')
+                options.get('kubespray_tag'),
+                git_cache_dir(options)
             )
 
 
-def clone_git_repo(name, directory, git_repo, tag=None):
+def git_cache_dir(options):
+    cache_dir = options.get('kubespray_cache_dir')
+    if cache_dir:
+        return os.path.expanduser(cache_dir)
+    return os.path.join(
+        os.environ.get(
+            'XDG_CACHE_HOME', os.path.join(os.path.expanduser("~"), '.cache')
+        ),
+        'kubespray'
+    )
+
+
+def git_succeeds(cmd):
+    return call(cmd, stdout=DEVNULL, stderr=DEVNULL) == 0
+
+
+def git_mirror_has_ref(mirror, ref, fixed_only=False):
+    '''
+    Check that a ref is available in the mirror. With fixed_only only tags
+    and commit ids are accepted, branches may have moved upstream.
+    '''
+    if fixed_only and git_succeeds(
+            ['git', '--git-dir', mirror, 'show-ref', '--verify', '-q',
+             'refs/heads/%s' % ref]):
+        return False
+    return git_succeeds(
+        ['git', '--git-dir', mirror, 'rev-parse', '--verify', '-q',
+         '%s^{commit}' % ref]
+    )
+
+
+def update_git_mirror(name, git_repo, cache_dir, ref=None):
+    '''
+    Keep a bare mirror of a git repo in the cache directory, updated with
+    incremental fetches. Returns the mirror path.
+    '''
+    mirror = os.path.join(
+        cache_dir, 'git', re.sub('[^A-Za-z0-9._-]+', '_', git_repo)
+    )
+    if not os.path.isdir(mirror):
+        display.banner('MIRRORING %s GIT REPO' % name.upper())
+        rcode, emsg = run_command(
+            'Mirror %s repository' % name,
+            ['git', 'clone', '--mirror', git_repo, mirror]
+        )
+        if rcode != 0:
+            shutil.rmtree(mirror, ignore_errors=True)
+            display.error('Cannot mirror %s repository %s' % (name, git_repo))
+            sys.exit(1)
+        return mirror
+    # Checkouts made by older versions borrow the mirror objects (clone
+    # --shared): they must never be pruned
+    git_succeeds(['git', '--git-dir', mirror, 'config', 'gc.pruneExpire',
+                  'never'])
+    if ref and git_mirror_has_ref(mirror, ref, fixed_only=True):
+        display.display('%s %s found in the cache' % (name, ref))
+        return mirror
+    display.banner('UPDATING %s GIT MIRROR' % name.upper())
+    rcode, emsg = run_command(
+        'Update %s mirror' % name,
+        ['git', '--git-dir', mirror, 'fetch', '--prune', 'origin']
+    )
+    if rcode != 0:
+        if ref and not git_mirror_has_ref(mirror, ref):
+            display.error('Cannot fetch %s %s from %s' % (name, ref, git_repo))
+            sys.exit(1)
+        display.warning(
+            'Cannot update the mirror %s, using the cached content' % mirror
+        )
+    return mirror
+
+
+def clone_git_repo(name, directory, git_repo, tag=None, cache_dir=None):
+    '''
+    Checkout a git repo in directory from a local mirror. The objects are
+    hard linked from the mirror (copied across filesystems): the checkout
+    costs little disk and does not depend on the mirror afterwards.
+    '''
     if which('git') is None:
         display.error('Cannot find git binary! check your installation')
         sys.exit(1)
     if os.path.isdir(directory):
         shutil.rmtree(directory)
+    if cache_dir is None:
+        cache_dir = git_cache_dir({})
+    mirror = update_git_mirror(name, git_repo, cache_dir, tag)
     display.banner('CLONING %s GIT REPO' % name.upper())
+    cmds = [
+        ['git', 'clone', '--local', '--no-checkout', mirror, directory],
+        ['git', '-C', directory, 'remote', 'set-url', 'origin', git_repo],
+    ]
     if tag:
-        cmd = ["git", "-b", "'v2.3.0'", "--single-branch", "--depth", "1",
-               git_repo, directory]
+        cmds.append(['git', '-C', directory, 'checkout', '-q', tag])
     else:
-        cmd = ["git", "clone", git_repo, directory]
-    rcode, emsg = run_command('Clone kubespray repository from github', cmd)
-    if rcode != 0:
-        display.error('Cannot clone kubespray repository from github')
-        sys.exit(1)
+        cmds.append(['git', '-C', directory, 'checkout', '-q'])
+    for cmd in cmds:
+        rcode, emsg = run_command('Clone %s repository' % name, cmd)
+        if rcode != 0:
+            display.error('Cannot clone %s repository from %s' % (name, mirror))
+            sys.exit(1)
     display.display('%s repo cloned' % name, color='green')
 
 
-def run_command(description, cmd):
+def run_command(description, cmd, on_line=None, timeout=None,
+                idle_timeout=None, new_group=None, env=None, streams=(),
+                pass_fds=()):
     '''
     Execute a system command
     '''
+    runner = ProcessRunner(
+        cmd, on_line=on_line, timeout=timeout, idle_timeout=idle_timeout,
+        new_group=new_group, env=env, pass_fds=pass_fds
+    )
+    for fd, callback in streams:
+        runner.add_stream(fd, callback)
     try:
-        proc = Popen(
-            cmd, stdout=PIPE, stderr=STDOUT,
-            universal_newlines=True, shell=False
-        )
-
-        while True:
-            output = proc.stdout.readline()
-            if output == '' and proc.poll() is not None:
-                break
-            if output:
-                print(output.strip())
-
-            proc.poll()
-        return(proc.returncode, None)
-    except CalledProcessError as e:
-        display.error('%s: %s' % (description, e.output))
-        emsg = e.message
-        return(proc.returncode, emsg)
+        rcode = runner.run()
+    except CommandTimeout as e:
+        display.error('%s: %s' % (description, e))
+        return(runner.returncode, str(e))
+    except OSError as e:
+        display.error('%s: %s' % (description, e))
+        return(1, str(e))
+    except TypeError as e:
+        # e.g. None in the arguments
+        display.error('%s: invalid command %r: %s' % (description, cmd, e))
+        return(1, str(e))
+    if rcode != 0:
+        return(rcode, '\n'.join(runner.tail))
+    return(rcode, None)
 
 
-def id_generator(size=6, chars=string.ascii_lowercase + string.digits):
-    return ''.join(random.choice(chars) for _ in range(size))
+def id_generator(size=6, chars=string.ascii_lowercase + string.digits,
+                 rng=random):
+    return ''.join(rng.choice(chars) for _ in range(size))
 
 
 def validate_cidr(cidr, version):
@@ -169,6 +291,7 @@ def validate_cidr(cidr, version):
     not. Version can be "4", "6", None for "IPv4", "IPv6", or "either"
     respectively.
     """
+    import netaddr
     try:
         netaddr.IPNetwork(cidr, version=version)
         return True
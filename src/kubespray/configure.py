@@ -24,15 +24,14 @@ Configuration management for Kubespray
 """
 import sys
 import os
-import yaml
-from ansible.utils.display import Display
-from kubespray.common import read_password
+from kubespray import yamlio
+from kubespray.common import display, read_password
 
 
 class Config(object):
 
     def __init__(self, configfile):
-        self.display = Display()
+        self.display = display
         self.configfile = configfile
         self.logfile = None
         self.loglevel = None
@@ -40,11 +39,11 @@ class Config(object):
     @property
     def parse_configfile(self):
         """
-        Retrieve configuration parameters from the config file
+        Retrieve configuration parameters from the config file, parsed
+        once per process
         """
         try:
-            with open(self.configfile, "r") as f:
-                config = yaml.load(f)
+            config = yamlio.read(self.configfile)
         except Exception:
             self.display.error(
                 "Can't read configuration file %s" % self.configfile
@@ -52,6 +51,22 @@ class Config(object):
             sys.exit(1)
         return config
 
+    def script_values(self):
+        '''
+        Options of a run without arguments, e.g. by Ansible as an inventory
+        script: the config file is optional
+        '''
+        config = {}
+        if os.path.isfile(self.configfile):
+            config = self.parse_configfile or {}
+        if 'kubespray_path' not in list(config.keys()):
+            config['kubespray_path'] = os.path.join(os.path.expanduser("~"), '.kubespray')
+        if 'inventory_path' not in list(config.keys()):
+            config['inventory_path'] = os.path.join(
+                config['kubespray_path'], 'inventory/inventory.cfg'
+            )
+        return(config)
+
     def default_values(self, args, config):
         # Set kubespray_path
         if 'kubespray_path' not in list(config.keys()) and args.kubespray_path is None:
@@ -26,15 +26,61 @@ Deploy a kubernetes cluster. Run the ansible-playbbook
 import re
 import sys
 import os
-import yaml
 import signal
-import netaddr
+import tempfile
+from collections import OrderedDict
 from subprocess import PIPE, STDOUT, Popen, check_output, CalledProcessError
-from kubespray.common import get_logger, query_yes_no, run_command, which, validate_cidr
-from ansible.utils.display import Display
-display = Display()
-playbook_exec = which('ansible-playbook')
-ansible_exec = which('ansible')
+from kubespray.common import display, get_logger, query_yes_no, run_command, which, validate_cidr
+from kubespray.events import EventRecorder, ProgressView, callback_env, new_run_path
+from kubespray import output
+from kubespray.inventory import CfgInventory
+from kubespray.logger import run_id
+from kubespray.state import DeployState, FactCache, fact_cache_env
+
+
+def playbook_exec():
+    return which('ansible-playbook')
+
+
+def ansible_exec():
+    return which('ansible')
+
+
+# ssh options reaching the hosts through another one: -o ProxyCommand=,
+# ProxyJump in ~/.ssh/config, -J
+PROXY_RE = re.compile(r'^[^#\n]*(\bProxy(Command|Jump)\b|(^|[\s=])-J\s*\S)',
+                      re.MULTILINE | re.IGNORECASE)
+
+# Kubespray's bastion group: an INI section or a YAML/JSON key
+BASTION_RE = re.compile(r'^\s*(\[bastion\]|"?bastion"?\s*:)', re.MULTILINE)
+
+
+def limit_file(hosts):
+    '''
+    Write the hosts, one per line, to a temporary file for "--limit @file":
+    thousands of hostnames on the command line exceed the arguments size
+    limit. The caller removes it.
+    '''
+    fd, path = tempfile.mkstemp(prefix='kubespray-limit-', suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        f.write(''.join('%s\n' % h for h in hosts))
+    return path
+
+
+def proxy_in_file(path, pattern=PROXY_RE):
+    try:
+        with open(path) as f:
+            return pattern.search(f.read()) is not None
+    except (IOError, OSError, UnicodeDecodeError):
+        return False
+
+
+# Maximum forks of the facts stage, unless set by a performance profile
+FACTS_FORKS = 50
+
+
+def discard_line(line):
+    pass
 
 
 class RunPlaybook(object):
@@ -45,6 +91,8 @@ class RunPlaybook(object):
         self.existing_ssh_agent = False
         self.options = options
         self.inventorycfg = options['inventory_path']
+        self.events = None
+        self.perf_config = None
         self.logger = get_logger(
             options.get('logfile'),
             options.get('loglevel')
@@ -54,6 +102,57 @@ class RunPlaybook(object):
             % self.options
         )
 
+    def new_group(self):
+        '''
+        Ansible prompts on the terminal for the become password, in that
+        case it must stay in our process group
+        '''
+        if self.options['ask_become_pass']:
+            return False
+        return None
+
+    def gathering(self):
+        '''
+        Facts gathering of the playbook: the performance profile's, else
+        smart to use the facts cached by the facts stage
+        '''
+        profile = self.options.get('perf_profile')
+        if not profile:
+            return 'smart'
+        from kubespray.perf import PROFILES
+        return PROFILES[profile]['gathering']
+
+    def ansible_env(self, env=None):
+        '''
+        Environment of the Ansible commands: with a performance profile,
+        they use the ansible.cfg generated for this run
+        '''
+        profile = self.options.get('perf_profile')
+        if not profile:
+            return env
+        if self.perf_config is None:
+            from kubespray.perf import write_profile
+            host_count = len(self.inventory_model() or ())
+            try:
+                self.perf_config, settings = write_profile(
+                    self.options, profile, host_count)
+            except (IOError, OSError) as e:
+                display.error('Cannot write the ansible.cfg: %s' % e)
+                self.kill_ssh_agent()
+                sys.exit(1)
+            self.logger.info('Performance profile %s, %s: %s' % (
+                profile, self.perf_config,
+                '; '.join('[%s] %s' % (section, ', '.join(
+                    '%s=%s' % kv for kv in values.items()))
+                    for section, values in settings.items())
+            ))
+            display.display('Performance profile %s: %s forks, pipelining %s'
+                            % (profile, settings['defaults']['forks'],
+                               settings['ssh_connection']['pipelining']))
+        env = dict(os.environ if env is None else env)
+        env['ANSIBLE_CONFIG'] = self.perf_config
+        return env
+
     def kill_ssh_agent(self):
         if self.existing_ssh_agent:
             return
@@ -75,7 +174,7 @@ class RunPlaybook(object):
             return
 
         try:
-            sshagent = check_output('ssh-agent')
+            sshagent = check_output('ssh-agent', universal_newlines=True)
         except CalledProcessError as e:
             display.error('Cannot run the ssh-agent : %s' % e.output)
         # Set environment variables
@@ -89,7 +188,8 @@ class RunPlaybook(object):
             else:
                 cmd = 'ssh-add'
             proc = Popen(
-                cmd, stdout=PIPE, stderr=STDOUT, stdin=PIPE
+                cmd, stdout=PIPE, stderr=STDOUT, stdin=PIPE,
+                universal_newlines=True
             )
             proc.stdin.write('password\n')
             proc.stdin.flush()
@@ -118,9 +218,116 @@ class RunPlaybook(object):
         '''
          Check if hosts are reachable
         '''
+        from kubespray.probe import format_results, probe_hosts
         display.banner('CHECKING SSH CONNECTIONS')
+        targets = self.probe_targets()
+        if targets is None:
+            # Cannot probe the hosts directly, let Ansible connect to them
+            self.ansible_ping()
+            return
+        targets, templated = targets
+        if templated:
+            self.logger.info('Addresses resolved by Ansible, not probed: %s'
+                             % ', '.join(templated))
+        results = []
+        if targets:
+            results = probe_hosts(
+                targets,
+                concurrency=int(self.options.get('probe_concurrency', 200)),
+                timeout=float(self.options.get('probe_timeout', 10))
+            )
+            for line in format_results(results):
+                display.display(line)
+        failed = [r.host for r in results if not r.ok]
+        if failed:
+            # Ansible may reach them in a way we do not know about (ssh
+            # options of the Ansible config, a wrapper...): it decides
+            self.logger.warning(
+                'Cannot connect to hosts: %s' % ', '.join(failed))
+            display.warning('%d hosts are not reachable directly, checking'
+                            ' them with Ansible' % len(failed))
+        if self.options.get('deep_check'):
+            self.ansible_ping()
+            return
+        if failed or templated:
+            self.ansible_ping(failed + templated)
+            return
+        display.display('All hosts are reachable', color='green')
+
+    def inventory_model(self):
+        '''
+        The parsed inventory, None when it is not a file we can read
+        (e.g. an inventory script)
+        '''
+        if not os.path.isfile(self.inventorycfg) or \
+                os.access(self.inventorycfg, os.X_OK):
+            return None
+        return CfgInventory(self.options, 'metal').load()
+
+    def probe_targets(self):
+        '''
+        Addresses to probe, None when the inventory is not a file we can
+        read or the hosts are reached through a proxy
+        '''
+        from kubespray.probe import inventory_targets
+        inventory = self.inventory_model()
+        if inventory is None:
+            return None
+        for host in inventory:
+            for name, value in host.hostvars.items():
+                if name == 'ansible_connection' or \
+                        PROXY_RE.search(str(value)):
+                    return None
+        proxy = self.proxy_config()
+        if proxy is not None:
+            self.logger.info('Hosts reached through a proxy (%s), not'
+                             ' probed directly' % proxy)
+            return None
+        return inventory_targets(inventory)
+
+    def proxy_config(self):
+        '''
+        Where Ansible is told to reach the hosts through a bastion or an
+        ssh proxy, None if nowhere: kubespray's bastion group, the
+        group_vars/host_vars next to the inventory and the playbooks,
+        ansible.cfg, the Ansible ssh variables and ~/.ssh/config
+        '''
+        if proxy_in_file(self.inventorycfg, BASTION_RE):
+            return 'bastion group'
+        args = ' '.join(self.options.get('ansible_opts') or [])
+        for var in ['ANSIBLE_SSH_ARGS', 'ANSIBLE_SSH_COMMON_ARGS',
+                    'ANSIBLE_SSH_EXTRA_ARGS']:
+            args = args + ' ' + os.environ.get(var, '')
+        if PROXY_RE.search(args):
+            return 'ssh arguments'
+        kubespray_path = self.options['kubespray_path']
+        inventory_dir = os.path.dirname(os.path.abspath(self.inventorycfg))
+        directories = []
+        for base in [inventory_dir, kubespray_path,
+                     os.path.join(kubespray_path, 'inventory')]:
+            for name in ['group_vars', 'host_vars']:
+                path = os.path.join(base, name)
+                if path not in directories:
+                    directories.append(path)
+        for directory in directories:
+            for root, dirs, files in os.walk(directory):
+                for name in files:
+                    if proxy_in_file(os.path.join(root, name)):
+                        return os.path.join(root, name)
+        for path in [os.environ.get('ANSIBLE_CONFIG'),
+                     os.path.join(kubespray_path, 'ansible.cfg'),
+                     os.path.expanduser('~/.ssh/config')]:
+            if path and proxy_in_file(path):
+                return path
+        return None
+
+    def ansible_ping(self, hosts=None):
+        '''
+        Connect to the hosts, all of them by default, and run the Ansible
+        ping module
+        '''
         cmd = [
-            ansible_exec, '--ssh-extra-args', '-o StrictHostKeyChecking=no',
+            ansible_exec(), '--ssh-extra-args=-o StrictHostKeyChecking=no',
             '-u', '%s' % self.options['ansible_user'],
             '-b', '--become-user=root', '-m', 'ping', 'all',
             '-i', self.inventorycfg
@@ -133,8 +340,21 @@ class RunPlaybook(object):
             cmd = cmd + ['--ask-become-pass']
         if self.options['coreos']:
             cmd = cmd + ['-e', 'ansible_python_interpreter=/opt/bin/python']
+        limit_path = None
+        if hosts:
+            limit_path = limit_file(hosts)
+            cmd = cmd + ['--limit', '@%s' % limit_path]
         display.display(' '.join(cmd))
-        rcode, emsg = run_command('SSH ping hosts', cmd)
+        try:
+            rcode, emsg = run_command(
+                'SSH ping hosts', cmd,
+                timeout=self.options.get('command_timeout'),
+                idle_timeout=self.options.get('command_idle_timeout'),
+                new_group=self.new_group(), env=self.ansible_env()
+            )
+        finally:
+            if limit_path is not None:
+                os.unlink(limit_path)
         if rcode != 0:
             self.logger.critical('Cannot connect to hosts: %s' % emsg)
             self.kill_ssh_agent()
@@ -143,6 +363,7 @@ class RunPlaybook(object):
 
     def get_subnets(self):
         '''Check the subnet value and split into 2 distincts subnets'''
+        import netaddr
         svc_pfx = 17
         pods_pfx = 17
         net = netaddr.IPNetwork(self.options['kube_network'])
@@ -162,34 +383,302 @@ class RunPlaybook(object):
 
     def read_kube_versions(self):
         """
-        Read the kubernetes versions from karo's vars file
+        The kubernetes versions of the kubespray checkout, a set indexed
+        once per commit
         """
-        kube_vers_file = os.path.join(
-            self.options['kubespray_path'] + '/roles/download/vars/kube_versions.yml'
+        from kubespray.versions import kube_versions
+        return kube_versions(self.options)
+
+    def new_nodes(self):
+        '''
+        The hosts added to the inventory since the last successful
+        deployment. scale.yml only deploys nodes: new masters or etcd
+        members need a full deployment.
+        '''
+        deployed = DeployState(self.options).deployed_hosts()
+        if deployed is None:
+            display.error(
+                'No successful deployment recorded for %s, run a full'
+                ' deployment first' % self.inventorycfg
+            )
+            self.kill_ssh_agent()
+            sys.exit(1)
+        inventory = CfgInventory(self.options, 'metal').load()
+        deployed = set(deployed)
+        new_hosts = [h.name for h in inventory if h.name not in deployed]
+        for group in ['kube-master', 'etcd']:
+            members = [h for h in new_hosts if h in inventory.groups[group]]
+            if members:
+                display.error(
+                    'New %s hosts need a full deployment: %s'
+                    % (group, ', '.join(members))
+                )
+                self.kill_ssh_agent()
+                sys.exit(1)
+        return new_hosts
+
+    def control_plane(self, inventory):
+        hosts = OrderedDict()
+        if inventory is None:
+            return []
+        for group in ['kube-master', 'etcd']:
+            hosts.update((h, None) for h in inventory.group_hosts(group))
+        return list(hosts)
+
+    def gather_facts(self, hosts=None):
+        '''
+        Facts stage: gather in parallel the facts of the hosts which are
+        not cached, expired or changed since. The playbook then runs with
+        smart gathering and uses the cached facts.
+        '''
+        display.banner('GATHERING FACTS')
+        if self.gathering() != 'smart':
+            display.display('%s gathering, facts are gathered by the'
+                            ' playbook' % self.gathering().capitalize())
+            return
+        inventory = self.inventory_model()
+        if inventory is None:
+            display.display('Cannot read the inventory, facts are gathered'
+                            ' by the playbook')
+            return
+        cache = FactCache(self.options)
+        hosts = hosts or list(inventory.hosts)
+        stale = cache.stale_hosts(
+            inventory, hosts, self.options.get('refresh_facts'))
+        if not stale:
+            display.display('The facts of the %d hosts are cached' % len(hosts),
+                            color='green')
+            return
+        display.display('Gathering the facts of %d hosts (%d cached)'
+                        % (len(stale), len(hosts) - len(stale)))
+        cmd = [
+            ansible_exec(), '--ssh-extra-args=-o StrictHostKeyChecking=no',
+            '-u', '%s' % self.options['ansible_user'],
+            '-b', '--become-user=root', '-m', 'setup', 'all',
+            '-i', self.inventorycfg
+        ]
+        limit_path = None
+        if len(stale) < len(inventory.hosts):
+            limit_path = limit_file(stale)
+            cmd = cmd + ['--limit', '@%s' % limit_path]
+        if not self.options.get('perf_profile'):
+            cmd = cmd + ['-f', str(min(len(stale), FACTS_FORKS))]
+        if self.options.get('ansible_opts'):
+            cmd = cmd + self.options["ansible_opts"]
+        if self.options['ask_become_pass']:
+            cmd = cmd + ['--ask-become-pass']
+        if self.options.get('coreos'):
+            cmd = cmd + ['-e', 'ansible_python_interpreter=/opt/bin/python']
+        self.logger.info('Gathering facts: %s' % ' '.join(cmd))
+        try:
+            rcode, emsg = run_command(
+                'Gather facts', cmd, on_line=discard_line,
+                timeout=self.options.get('command_timeout'),
+                idle_timeout=self.options.get('command_idle_timeout'),
+                new_group=self.new_group(),
+                env=self.ansible_env(fact_cache_env(self.options))
+            )
+        finally:
+            if limit_path is not None:
+                os.unlink(limit_path)
+        try:
+            missing = cache.record(inventory, stale)
+        except (IOError, OSError) as e:
+            display.warning('Cannot record the gathered facts: %s' % e)
+            return
+        if missing:
+            # The playbook reports these hosts errors
+            display.warning('Cannot gather the facts of %s'
+                            % ', '.join(missing))
+            self.logger.warning('Facts stage failed: %s' % emsg)
+        else:
+            display.display('Facts gathered', color='green')
+
+    def output_log(self):
+        '''
+        The compressed log of the whole output, next to the events log.
+        None when disabled with output_log: false
+        '''
+        if not self.options.get('output_log', True):
+            return None
+        compression = self.options.get('output_log_compression', 'gzip')
+        max_bytes = int(float(self.options.get(
+            'output_log_max_mb', output.LOG_MAX_MB)) * 1024 * 1024)
+        try:
+            return output.CompressedLog(
+                output.output_log_path(self.events.logfile, compression),
+                max_bytes, compression
+            )
+        except ImportError:
+            display.warning('The zstandard module is not installed,'
+                            ' the output log is compressed with gzip')
+        except (KeyError, ValueError):
+            display.warning('Unknown output_log_compression %s, the output'
+                            ' log is compressed with gzip' % compression)
+        return output.CompressedLog(
+            output.output_log_path(self.events.logfile), max_bytes
         )
+
+    def run_playbook(self, description, cmd, env=None):
+        '''
+        Run ansible-playbook with the events callback plugin enabled.
+        The events are kept in self.events and saved in the runs directory.
+        The output goes to the terminal (unless --progress or --quiet) and
+        to a compressed log, the last lines of the failed hosts are printed
+        when the run fails or is interrupted.
+        '''
+        self.events = EventRecorder(new_run_path(self.options))
+        progress = None
+        if self.options.get('progress') or self.options.get('quiet'):
+            progress = ProgressView()
+            if not self.options.get('quiet'):
+                self.events.listeners.append(progress)
+        log = self.output_log()
+        terminal = None
+        if progress is None:
+            terminal = output.TerminalQueue(
+                log_path=log.path if log is not None else None)
+        tail = output.HostTail(
+            int(self.options.get('output_tail_lines', output.TAIL_LINES)))
+        pipeline = output.OutputPipeline([terminal, tail, log])
+        self.logger.info('Playbook events log: %s' % self.events.logfile)
+        if log is not None:
+            self.logger.info('Playbook output log: %s' % log.path)
+        read_fd, write_fd = os.pipe()
         try:
-            with open(kube_vers_file, "r") as f:
-                kube_versions_vars = yaml.load(f)
-        except IOError as e:
-            display.error('Cannot read kube_versions file %s: %s'
-                          % (kube_vers_file, e)
-                          )
-            sys.exit(1)
-        kube_versions = list()
-        for i in kube_versions_vars['kube_checksum']:
-            kube_versions.append(i)
-        return kube_versions
+            try:
+                rcode, emsg = run_command(
+                    description, cmd, on_line=pipeline,
+                    timeout=self.options.get('command_timeout'),
+                    idle_timeout=self.options.get('command_idle_timeout'),
+                    new_group=self.new_group(),
+                    env=callback_env(write_fd, self.ansible_env(env)),
+                    streams=[(read_fd, self.events)], pass_fds=[write_fd]
+                )
+            finally:
+                pipeline.close()
+                self.events.close()
+        except KeyboardInterrupt:
+            # The hosts which failed, else those the run stopped at
+            self.dump_tails(tail, log, self.events.running_hosts())
+            raise
+        if log is not None and log.error is not None:
+            display.warning('Cannot write the output log %s: %s'
+                            % (log.path, log.error))
+        if progress is not None:
+            progress.finish(self.events)
+        if rcode != 0:
+            self.dump_tails(tail, log)
+        return(rcode, emsg)
+
+    def dump_tails(self, tail, log, hosts=()):
+        '''Print the last lines of the failed hosts, else of hosts'''
+        failed = [h for h, status in self.events.host_status().items()
+                  if status != 'ok'] or list(tail.failed) or list(hosts)
+        tail.dump(failed, log_path=log.path if log is not None else None)
+
+    def resume_point(self):
+        '''
+        Where to resume the last run: (playbook name, hosts to limit the run
+        to, task to start at or None)
+        '''
+        from kubespray.profiler import find_run
+        path = find_run(self.options, 'latest')
+        recorder = EventRecorder.load(path)
+        # Playbook name, relative to the kubespray path
+        playbook = os.path.basename(recorder.playbook or 'cluster.yml')
+        display.display('Resuming the run %s (%s)' % (
+            os.path.basename(path), playbook))
+        # The final status of the hosts comes from the playbook stats: the
+        # failures handled by a rescue section are not resumed
+        if recorder.stats is not None and not recorder.failed_hosts():
+            display.display('The last run succeeded, nothing to resume',
+                            color='green')
+            self.kill_ssh_agent()
+            sys.exit(0)
+        if recorder.stats is None:
+            # Interrupted: the hosts of the run stopped at the last task
+            hosts = list(recorder.host_status())
+            play = recorder.plays[-1] if recorder.plays else None
+        else:
+            hosts = recorder.failed_hosts()
+            plays = recorder.failed_plays()
+            # With failures in several plays, the earliest one is rerun
+            play = plays[0] if plays else None
+        return playbook, hosts, self.start_task(recorder, play)
+
+    def start_task(self, recorder, play):
+        '''
+        The first task of the play, for --start-at-task. Starting there is
+        only safe when the task has a name of its own (role tasks are
+        named "role : name") found once in the run: --start-at-task runs
+        from the first task of that name and skips the whole playbook if
+        there is none.
+        '''
+        if play is None or play is recorder.plays[0]:
+            return None
+        names = [t.name for t in recorder.tasks.values()]
+        for task in play.tasks:
+            if task.handler or task.name in ('Gathering Facts',
+                                             'Gather Facts'):
+                continue
+            if task.name and ' : ' in task.name and \
+                    names.count(task.name) == 1:
+                return task.name
+            return None
+        return None
+
+    def record_deployment(self, new_nodes=None):
+        state = DeployState(self.options)
+        inventory = self.inventory_model()
+        if inventory is None:
+            return
+        hosts = [h.name for h in inventory]
+        if new_nodes:
+            deployed = set(state.deployed_hosts() or ()) | set(new_nodes)
+            hosts = [h for h in hosts if h in deployed]
+        try:
+            state.record(hosts, run_id())
+        except (IOError, OSError) as e:
+            display.warning('Cannot record the deployment: %s' % e)
 
     def deploy_kubernetes(self):
         '''
         Run the ansible playbook command
         '''
+        playbook = 'cluster.yml'
+        new_nodes = None
+        limit = None
+        start_at = None
+        if self.options.get('resume'):
+            playbook, limit, start_at = self.resume_point()
+            if playbook == 'scale.yml':
+                new_nodes = limit
+            if limit:
+                display.display('Failed hosts: %s' % ', '.join(limit))
+            if start_at:
+                display.display('Starting at: %s' % start_at)
+        elif self.options.get('new_nodes_only'):
+            new_nodes = self.new_nodes()
+            if not new_nodes:
+                display.display('No new node to deploy', color='green')
+                self.kill_ssh_agent()
+                return
+            display.display('New nodes: %s' % ', '.join(new_nodes))
+            playbook = 'scale.yml'
+            limit = new_nodes
+        playbook = os.path.join(self.options['kubespray_path'], playbook)
+        if not os.path.isfile(playbook):
+            display.error('Cannot find the playbook %s' % playbook)
+            self.kill_ssh_agent()
+            sys.exit(1)
         cmd = [
-            playbook_exec, '--ssh-extra-args', '-o StrictHostKeyChecking=no',
+            playbook_exec(), '--ssh-extra-args=-o StrictHostKeyChecking=no',
             '-u',  '%s' % self.options['ansible_user'],
-            '-b', '--become-user=root', '-i', self.inventorycfg,
-            os.path.join(self.options['kubespray_path'], 'cluster.yml')
+            '-b', '--become-user=root', '-i', self.inventorycfg, playbook
         ]
+        if start_at:
+            cmd = cmd + ['--start-at-task', start_at]
         # Configure network plugin if defined
         if 'network_plugin' in list(self.options.keys()):
             cmd = cmd + [
@@ -225,7 +714,7 @@ class RunPlaybook(object):
             if self.options['kube_version'] not in available_kube_versions:
                 display.error(
                     'Kubernetes version %s is not supported, available versions = %s' %
-                    (self.options['kube_version'], ','.join(available_kube_versions))
+                    (self.options['kube_version'], ','.join(available_kube_versions.sorted()))
                 )
                 sys.exit(1)
             cmd = cmd + ['-e', 'kube_version=%s' % self.options['kube_version']]
@@ -265,21 +754,43 @@ class RunPlaybook(object):
                 % (pods_network.cidr, str(pods_network.size.real - 2)),
                 color='bright gray'
             )
-        display.display(' '.join(cmd), color='bright blue')
-        if not self.options['assume_yes']:
-            if not query_yes_no(
-                'Run kubernetes cluster deployment with the above command ?'
-            ):
-                display.display('Aborted', color='red')
-                sys.exit(1)
-        display.banner('RUN PLAYBOOK')
-        self.logger.info(
-            'Running kubernetes deployment with the command: %s' % ' '.join(cmd)
-        )
-        rcode, emsg = run_command('Run deployment', cmd)
+        limit_path = None
+        if limit:
+            limit_path = limit_file(limit)
+            cmd = cmd + ['--limit', '@%s' % limit_path]
+        try:
+            display.display(' '.join(cmd), color='bright blue')
+            if not self.options['assume_yes']:
+                if not query_yes_no(
+                    'Run kubernetes cluster deployment with the above command ?'
+                ):
+                    display.display('Aborted', color='red')
+                    sys.exit(1)
+            # The limited hosts play with the masters and etcd members (or
+            # rely on their facts with scale.yml)
+            if limit:
+                self.gather_facts(limit + [
+                    h for h in self.control_plane(self.inventory_model())
+                    if h not in limit
+                ])
+            else:
+                self.gather_facts()
+            display.banner('RUN PLAYBOOK')
+            self.logger.info(
+                'Running kubernetes deployment with the command: %s'
+                % ' '.join(cmd)
+            )
+            rcode, emsg = self.run_playbook(
+                'Run deployment', cmd,
+                fact_cache_env(self.options, gathering=self.gathering())
+            )
+        finally:
+            if limit_path is not None:
+                os.unlink(limit_path)
         if rcode != 0:
             self.logger.critical('Deployment failed: %s' % emsg)
             self.kill_ssh_agent()
             sys.exit(1)
+        self.record_deployment(new_nodes)
         display.display('Kubernetes deployed successfuly', color='green')
         self.kill_ssh_agent()
@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.events
+~~~~~~~~~~~~
+
+Structured Ansible events: recording, live progress and run logs
+"""
+
+import json
+import os
+import sys
+import time
+
+from collections import OrderedDict
+from kubespray.logger import run_id
+
+CALLBACK_NAME = 'kubespray_events'
+CALLBACK_PLUGINS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'files', 'callback_plugins'
+)
+STATUSES = ('ok', 'changed', 'failed', 'skipped', 'unreachable', 'rescued')
+# Names of the callbacks setting in ansible.cfg and in the environment
+CALLBACKS_KEYS = ('callbacks_enabled', 'callback_whitelist')
+CALLBACKS_VARS = ('ANSIBLE_CALLBACKS_ENABLED', 'ANSIBLE_CALLBACK_WHITELIST')
+
+
+def runs_dir(options):
+    '''The run event logs are stored next to kubespray.log'''
+    return os.path.join(os.path.dirname(options['logfile']), 'runs')
+
+
+def new_run_path(options):
+    return os.path.join(runs_dir(options), '%s.ndjson' % run_id())
+
+
+def callbacks_enabled_var():
+    '''
+    Variable enabling callback plugins: ANSIBLE_CALLBACK_WHITELIST before
+    Ansible 2.11, which then warns that it is deprecated
+    '''
+    try:
+        from ansible.release import __version__
+        version = tuple(int(n) for n in __version__.split('.')[:2])
+    except (ImportError, ValueError):
+        return 'ANSIBLE_CALLBACKS_ENABLED'
+    if version < (2, 11):
+        return 'ANSIBLE_CALLBACK_WHITELIST'
+    return 'ANSIBLE_CALLBACKS_ENABLED'
+
+
+def ansible_config(env):
+    '''
+    The ansible.cfg Ansible reads, in its search order, None when there is
+    none
+    '''
+    candidates = [env.get('ANSIBLE_CONFIG'), 'ansible.cfg',
+                  '~/.ansible.cfg', '/etc/ansible/ansible.cfg']
+    for path in candidates:
+        if not path:
+            continue
+        path = os.path.abspath(os.path.expanduser(path))
+        if os.path.isdir(path):
+            path = os.path.join(path, 'ansible.cfg')
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def configured_callbacks(env):
+    '''
+    (callback plugin paths, enabled callbacks) set in the environment or,
+    when it does not set them, in the ansible.cfg: Ansible reads the
+    environment first
+    '''
+    paths = [p for p in env.get('ANSIBLE_CALLBACK_PLUGINS', '').split(
+        os.pathsep) if p]
+    enabled = [c for var in CALLBACKS_VARS
+               for c in env.get(var, '').split(',') if c.strip()]
+    if paths and enabled:
+        return paths, enabled
+    path = ansible_config(env)
+    if path is None:
+        return paths, enabled
+    import configparser
+    config = configparser.RawConfigParser()
+    try:
+        config.read(path)
+    except configparser.Error:
+        return paths, enabled
+    if not config.has_section('defaults'):
+        return paths, enabled
+    if not paths and config.has_option('defaults', 'callback_plugins'):
+        # Relative paths are relative to the ansible.cfg
+        paths = [
+            os.path.normpath(os.path.join(os.path.dirname(path),
+                                          os.path.expanduser(p.strip())))
+            for p in config.get('defaults', 'callback_plugins').split(
+                os.pathsep) if p.strip()
+        ]
+    if not enabled:
+        for key in CALLBACKS_KEYS:
+            if config.has_option('defaults', key):
+                enabled = [c.strip() for c in config.get(
+                    'defaults', key).split(',') if c.strip()]
+                break
+    return paths, enabled
+
+
+def callback_env(events_fd, env=None):
+    '''
+    Environment enabling the bundled callback plugin for an
+    ansible-playbook run writing its events to events_fd. The callbacks
+    already set in the environment or in the ansible.cfg are kept: the
+    variables replace the ansible.cfg settings.
+    '''
+    env = dict(os.environ if env is None else env)
+    paths, enabled = configured_callbacks(env)
+    env['ANSIBLE_CALLBACK_PLUGINS'] = os.pathsep.join(
+        [CALLBACK_PLUGINS] + [p for p in paths if p != CALLBACK_PLUGINS])
+    var = callbacks_enabled_var()
+    env[var] = ','.join(
+        [CALLBACK_NAME] + [c for c in enabled if c != CALLBACK_NAME])
+    for other in CALLBACKS_VARS:
+        if other != var and other in env:
+            env[other] = env[var]
+    env['KUBESPRAY_EVENTS_FD'] = str(events_fd)
+    return env
+
+
+class HostResult(object):
+    __slots__ = ('start', 'end', 'status', 'changed', 'msg')
+
+    def __init__(self, start):
+        self.start = start
+        self.end = None
+        self.status = None
+        self.changed = False
+        self.msg = None
+
+    @property
+    def duration(self):
+        if self.end is None:
+            return 0
+        return self.end - self.start
+
+
+class TaskRecord(object):
+
+    def __init__(self, uuid, name, play, start, handler=False):
+        self.uuid = uuid
+        self.name = name
+        self.play = play
+        self.start = start
+        self.end = start
+        self.handler = handler
+        self.hosts = OrderedDict()
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class PlayRecord(object):
+
+    def __init__(self, uuid, name, start):
+        self.uuid = uuid
+        self.name = name
+        self.start = start
+        self.end = start
+        self.tasks = []
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class EventRecorder(object):
+    '''
+    Keep the events of a playbook run in memory, with per-task and per-host
+    start/end timestamps and statuses, and append them to an NDJSON log.
+
+    An instance is a line callback for kubespray.process.ProcessRunner.
+    '''
+
+    def __init__(self, logfile=None):
+        self.logfile = logfile
+        self.plays = []
+        self.tasks = OrderedDict()
+        self.counters = dict((s, 0) for s in STATUSES)
+        self.failures = []
+        self.stats = None
+        self.playbook = None
+        self.start = None
+        self.end = None
+        self.listeners = []
+        self._pending = []
+        self._log = None
+
+    @classmethod
+    def load(cls, path):
+        '''Replay a recorded run log'''
+        recorder = cls()
+        with open(path) as f:
+            for line in f:
+                recorder.parse(line)
+        return recorder
+
+    def __call__(self, line):
+        if self.logfile:
+            self._pending.append(line)
+        self.parse(line)
+
+    def parse(self, line):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return
+        if isinstance(event, dict):
+            self.record(event)
+
+    def record(self, event):
+        handler = getattr(self, '_on_%s' % event.get('event'), None)
+        if handler is None:
+            return
+        ts = event.get('ts', time.time())
+        if self.start is None:
+            self.start = ts
+        self.end = max(self.end or ts, ts)
+        handler(event, ts)
+        for listener in self.listeners:
+            listener(self, event)
+
+    def _on_playbook_start(self, event, ts):
+        # The playbook path is relative to the directory ansible-playbook
+        # ran in: only its name is kept
+        playbook = event.get('playbook')
+        self.playbook = os.path.basename(playbook) if playbook else None
+
+    def _on_play_start(self, event, ts):
+        self.plays.append(PlayRecord(event.get('id'), event.get('name'), ts))
+
+    def _on_task_start(self, event, ts):
+        if not self.plays:
+            self._on_play_start({}, ts)
+        play = self.plays[-1]
+        task = TaskRecord(
+            event.get('id'), event.get('name'), play, ts,
+            event.get('handler', False)
+        )
+        self.tasks[task.uuid] = task
+        play.tasks.append(task)
+
+    def _task_host(self, event, ts):
+        task = self.tasks.get(event.get('task'))
+        if task is None:
+            return None, None
+        host = task.hosts.get(event['host'])
+        if host is None:
+            host = task.hosts[event['host']] = HostResult(task.start)
+        return task, host
+
+    def _on_host_start(self, event, ts):
+        task, host = self._task_host(event, ts)
+        if host is not None:
+            host.start = ts
+
+    def _on_host_result(self, event, ts):
+        task, host = self._task_host(event, ts)
+        if host is None:
+            return
+        host.end = ts
+        host.status = event['status']
+        host.changed = event.get('changed', False)
+        host.msg = event.get('msg')
+        task.end = max(task.end, ts)
+        task.play.end = max(task.play.end, ts)
+        status = host.status
+        if status == 'ok' and host.changed:
+            status = 'changed'
+        if status == 'failed' and event.get('ignore_errors'):
+            status = 'ok'
+        elif status == 'failed' and event.get('rescued'):
+            # Handled by the rescue section of a block: not a failure
+            status = 'rescued'
+        if status in self.counters:
+            self.counters[status] += 1
+        if status in ('failed', 'unreachable'):
+            self.failures.append((event['host'], task, host))
+
+    def _on_stats(self, event, ts):
+        self.stats = event.get('hosts', {})
+
+    def host_status(self):
+        '''
+        Final status per host: ok, failed or unreachable. It is taken from
+        the playbook stats once the run completed: Ansible counts there
+        the failures handled by a rescue section as rescued, not as
+        failures.
+        '''
+        status = OrderedDict()
+        for task in self.tasks.values():
+            for name, host in task.hosts.items():
+                if name not in status:
+                    status[name] = 'ok'
+        if self.stats is not None:
+            for name, stats in self.stats.items():
+                if stats.get('unreachable'):
+                    status[name] = 'unreachable'
+                elif stats.get('failures'):
+                    status[name] = 'failed'
+                else:
+                    status[name] = 'ok'
+            return status
+        for name, task, host in self.failures:
+            if status.get(name) != 'unreachable':
+                status[name] = host.status
+        return status
+
+    def failed_hosts(self):
+        '''Hosts whose final status is failed or unreachable'''
+        return [name for name, status in self.host_status().items()
+                if status != 'ok']
+
+    def running_hosts(self):
+        '''Hosts without a result for the last task, e.g. interrupted'''
+        if not self.tasks:
+            return []
+        task = next(reversed(self.tasks.values()))
+        return [name for name, host in task.hosts.items()
+                if host.end is None]
+
+    def failed_plays(self):
+        '''The plays where hosts failed, in execution order'''
+        failed = set(self.failed_hosts())
+        plays = []
+        for name, task, host in self.failures:
+            if name in failed and task.play not in plays:
+                plays.append(task.play)
+        return plays
+
+    def flush(self):
+        if not self._pending:
+            return
+        if self._log is None:
+            logdir = os.path.dirname(self.logfile)
+            if logdir and not os.path.isdir(logdir):
+                os.makedirs(logdir)
+            self._log = open(self.logfile, 'a')
+        self._pending.append('')
+        self._log.write('\n'.join(self._pending))
+        self._log.flush()
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+class ProgressView(object):
+    '''
+    Compact live progress of a playbook run: a single status line with the
+    number of tasks done and the host results, failures are printed as they
+    happen.
+    '''
+
+    def __init__(self, stream=None, interval=0.2):
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.tty = self.stream.isatty()
+        self.last_render = 0
+        self.width = 0
+
+    def __call__(self, recorder, event):
+        if event['event'] == 'host_result' and \
+                event['status'] in ('failed', 'unreachable') and \
+                not event.get('ignore_errors') and \
+                not event.get('rescued'):
+            task = recorder.tasks.get(event.get('task'))
+            self.clear()
+            self.stream.write('%s: [%s] %s: %s\n' % (
+                'fatal' if event['status'] == 'failed' else 'unreachable',
+                event['host'], task.name if task else '',
+                event.get('msg', '')
+            ))
+        now = time.time()
+        if now - self.last_render >= self.interval:
+            self.render(recorder)
+            self.last_render = now
+
+    def status_line(self, recorder):
+        counters = recorder.counters
+        line = 'tasks %d | ok %d changed %d failed %d unreachable %d' % (
+            len(recorder.tasks), counters['ok'], counters['changed'],
+            counters['failed'], counters['unreachable']
+        )
+        if recorder.tasks:
+            line = line + ' | %s' % next(reversed(recorder.tasks.values())).name
+        return line
+
+    def clear(self):
+        if self.tty and self.width:
+            self.stream.write('\r%s\r' % (' ' * self.width))
+            self.width = 0
+
+    def render(self, recorder):
+        if not self.tty:
+            return
+        line = self.status_line(recorder)[:159]
+        self.clear()
+        self.stream.write(line)
+        self.stream.flush()
+        self.width = len(line)
+
+    def finish(self, recorder):
+        self.clear()
+        self.stream.write(self.status_line(recorder) + '\n')
+        for host, status in recorder.host_status().items():
+            if status != 'ok':
+                self.stream.write('%s: %s\n' % (host, status))
+        self.stream.flush()
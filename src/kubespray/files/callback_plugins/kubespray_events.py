@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Ansible callback plugin used by the kubespray CLI.
+
+Every playbook event is written as one JSON document per line (NDJSON) to
+the file descriptor given by the KUBESPRAY_EVENTS_FD environment variable.
+This file runs inside the ansible-playbook process and must not import the
+kubespray package.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = '''
+    callback: kubespray_events
+    type: notification
+    short_description: Stream playbook events to the kubespray CLI
+    description:
+      - Writes NDJSON events to the file descriptor KUBESPRAY_EVENTS_FD
+    requirements:
+      - enable in configuration
+'''
+
+
+class CallbackModule(CallbackBase):
+
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'notification'
+    CALLBACK_NAME = 'kubespray_events'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.stream = None
+        fd = os.environ.get('KUBESPRAY_EVENTS_FD')
+        if fd and fd.isdigit():
+            try:
+                self.stream = os.fdopen(int(fd), 'w')
+            except OSError:
+                self.stream = None
+
+    def emit(self, event, **fields):
+        if self.stream is None:
+            return
+        fields['event'] = event
+        fields['ts'] = time.time()
+        try:
+            self.stream.write(json.dumps(fields, default=str) + '\n')
+            self.stream.flush()
+        except (IOError, OSError, ValueError):
+            # The CLI went away, the playbook must not fail because of us
+            self.stream = None
+
+    def v2_playbook_on_start(self, playbook):
+        self.emit('playbook_start', playbook=playbook._file_name)
+
+    def v2_playbook_on_play_start(self, play):
+        self.emit('play_start', id=str(play._uuid), name=play.get_name())
+
+    def _task_start(self, task, is_handler=False):
+        self.emit(
+            'task_start', id=str(task._uuid), name=task.get_name(),
+            action=task.action, handler=is_handler
+        )
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._task_start(task)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._task_start(task, is_handler=True)
+
+    def v2_runner_on_start(self, host, task):
+        self.emit('host_start', host=host.get_name(), task=str(task._uuid))
+
+    def _result(self, status, result, **fields):
+        msg = result._result.get('msg')
+        if msg is not None and status in ('failed', 'unreachable'):
+            fields['msg'] = str(msg)[:2048]
+        self.emit(
+            'host_result', status=status, host=result._host.get_name(),
+            task=str(result._task._uuid),
+            changed=bool(result._result.get('changed', False)), **fields
+        )
+
+    def v2_runner_on_ok(self, result):
+        self._result('ok', result)
+
+    @staticmethod
+    def _rescued(task):
+        '''
+        Whether a failure of the task is handled by a rescue section: the
+        task is in the tasks (not the rescue or always) section of a block
+        which has one, or of a block nested there. Ansible then counts the
+        failure as rescued.
+        '''
+        child, parent = task, getattr(task, '_parent', None)
+        while parent is not None:
+            if getattr(parent, 'rescue', None) and any(
+                    getattr(t, '_uuid', None) == child._uuid
+                    for t in parent.block or ()):
+                return True
+            child, parent = parent, getattr(parent, '_parent', None)
+        return False
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        fields = {'ignore_errors': ignore_errors}
+        if not ignore_errors and self._rescued(result._task):
+            fields['rescued'] = True
+        self._result('failed', result, **fields)
+
+    def v2_runner_on_skipped(self, result):
+        self._result('skipped', result)
+
+    def v2_runner_on_unreachable(self, result):
+        self._result('unreachable', result)
+
+    def v2_playbook_on_stats(self, stats):
+        hosts = {}
+        for host in sorted(stats.processed.keys()):
+            hosts[host] = stats.summarize(host)
+        self.emit('stats', hosts=hosts)
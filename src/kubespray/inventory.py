@@ -23,17 +23,471 @@ kubespray.inventory
 Ansible inventory management for Kubespray
 """
 
+import json
+import os
 import sys
 import re
-from kubespray.common import get_logger, id_generator, get_cluster_name
-from ansible.utils.display import Display
-display = Display()
+from collections import OrderedDict
+from kubespray.common import (display, get_logger, id_generator,
+                              get_cluster_name, query_yes_no)
+from kubespray.fileutil import write_atomic
 
 try:
     import configparser
 except ImportError:
     import configparser as configparser
 
+# Parsed inventory files: path -> ((mtime, size), Inventory)
+_inventory_cache = {}
+
+
+class Host(object):
+    '''
+    An inventory host and its variables
+    '''
+    __slots__ = ('name', 'hostvars')
+
+    def __init__(self, name, hostvars=None):
+        self.name = name
+        self.hostvars = OrderedDict(hostvars or ())
+
+    def __repr__(self):
+        return 'Host(%r, %r)' % (self.name, dict(self.hostvars))
+
+    def vars_str(self):
+        return ' '.join('%s=%s' % (k, v) for k, v in self.hostvars.items())
+
+
+class Inventory(object):
+    '''
+    Kubespray's Ansible inventory.
+
+    Hosts are indexed by name, the 'all' group is that index. The other
+    groups are insertion ordered sets of hostnames (OrderedDict keys), so
+    adding, removing and looking up hosts are O(1) operations.
+    '''
+    GROUPS = ('kube-master', 'etcd', 'kube-node')
+    CHILDREN = OrderedDict([('k8s-cluster', ('kube-node', 'kube-master'))])
+
+    def __init__(self):
+        self.hosts = OrderedDict()
+        self.groups = OrderedDict((g, OrderedDict()) for g in self.GROUPS)
+        self._cluster_name = None
+
+    @property
+    def cluster_name(self):
+        '''
+        Hostnames generated by kubespray are made of the cluster name and
+        a random suffix, the cluster name is taken from the first host
+        '''
+        if self._cluster_name is None and self.hosts:
+            self._cluster_name = '-'.join(
+                self.first_host().name.split('-')[:-1]
+            )
+        return self._cluster_name
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def __iter__(self):
+        return iter(self.hosts.values())
+
+    def __contains__(self, name):
+        return name in self.hosts
+
+    def get(self, name):
+        return self.hosts.get(name)
+
+    def add_host(self, name, hostvars=None, groups=()):
+        '''
+        Add a host, or update the variables of an existing one
+        '''
+        host = self.hosts.get(name)
+        if host is None:
+            host = self.hosts[name] = Host(name, hostvars)
+        elif hostvars:
+            host.hostvars.update(hostvars)
+        for group in groups:
+            self.add_to_group(group, name)
+        return host
+
+    def remove_host(self, name):
+        self._cluster_name = None
+        self.hosts.pop(name, None)
+        for members in self.groups.values():
+            members.pop(name, None)
+
+    def add_to_group(self, group, name):
+        if name not in self.hosts:
+            self.add_host(name)
+        self.groups.setdefault(group, OrderedDict())[name] = None
+
+    def remove_from_group(self, group, name):
+        self.groups.get(group, {}).pop(name, None)
+
+    def group_hosts(self, group):
+        if group == 'all':
+            return list(self.hosts)
+        return list(self.groups.get(group, ()))
+
+    def groups_of(self, name):
+        return [g for g, members in self.groups.items() if name in members]
+
+    def first_host(self):
+        return next(iter(self.hosts.values()), None)
+
+    def copy(self):
+        inventory = Inventory()
+        for host in self:
+            inventory.add_host(host.name, host.hostvars)
+        for group, members in self.groups.items():
+            inventory.groups[group] = OrderedDict(members)
+        return inventory
+
+    def to_dynamic(self):
+        '''
+        The inventory as printed by an Ansible inventory script with
+        --list, host variables included in _meta
+        '''
+        data = OrderedDict()
+        data['_meta'] = {'hostvars': OrderedDict(
+            (host.name, host.hostvars) for host in self)}
+        data['all'] = {'hosts': list(self.hosts),
+                       'children': list(self.groups) + list(self.CHILDREN)}
+        for group, members in self.groups.items():
+            data[group] = {'hosts': list(members)}
+        for group, children in self.CHILDREN.items():
+            data[group] = {'children': list(children)}
+        return data
+
+    def sections(self):
+        '''
+        INI sections of the inventory: (section name, entries)
+        '''
+        yield 'all', [(h.name, h.vars_str()) for h in self]
+        for group, members in self.groups.items():
+            yield group, [(name, '') for name in members]
+        for group, children in self.CHILDREN.items():
+            yield '%s:children' % group, [(c, '') for c in children]
+
+
+class InventoryDiff(object):
+    '''
+    Changes turning the current inventory into the desired one: hosts
+    added or removed, group membership and host variables changes.
+    '''
+
+    def __init__(self):
+        self.hosts_added = []
+        self.hosts_removed = []
+        # group -> (hostnames added, hostnames removed)
+        self.groups = OrderedDict()
+        # hostname -> [(variable, old value, new value)], None when unset
+        self.hostvars = OrderedDict()
+        # Hosts added, the variables of an existing one and their values
+        self._desired = {}
+
+    @classmethod
+    def compute(cls, current, desired):
+        diff = cls()
+        for host in desired:
+            if host.name not in current:
+                diff.hosts_added.append(host.name)
+                diff._desired[host.name] = host.hostvars
+                continue
+            old = current.get(host.name).hostvars
+            changes = [(k, old.get(k), v) for k, v in host.hostvars.items()
+                       if old.get(k) != v]
+            changes.extend((k, v, None) for k, v in old.items()
+                           if k not in host.hostvars)
+            if changes:
+                diff.hostvars[host.name] = changes
+                diff._desired[host.name] = host.hostvars
+        diff.hosts_removed = [h.name for h in current if h.name not in desired]
+        for group in list(current.groups) + [
+                g for g in desired.groups if g not in current.groups]:
+            before = current.groups.get(group, {})
+            after = desired.groups.get(group, {})
+            added = [h for h in after if h not in before]
+            removed = [h for h in before if h not in after]
+            if added or removed:
+                diff.groups[group] = (added, removed)
+        return diff
+
+    def __bool__(self):
+        return bool(self.hosts_added or self.hosts_removed or
+                    self.groups or self.hostvars)
+
+    __nonzero__ = __bool__
+
+    def changed_hosts(self):
+        '''Hosts added or whose variables or groups changed'''
+        hosts = OrderedDict((h, None) for h in self.hosts_added)
+        hosts.update((h, None) for h in self.hostvars)
+        for added, removed in self.groups.values():
+            hosts.update((h, None) for h in added + removed
+                         if h not in self.hosts_removed)
+        return list(hosts)
+
+    def apply(self, inventory):
+        '''Edit the inventory in place, untouched hosts are left as is'''
+        for name in self.hosts_removed:
+            inventory.remove_host(name)
+        for name in self.hosts_added:
+            inventory.add_host(name, self._desired[name])
+        for name in self.hostvars:
+            inventory.get(name).hostvars = OrderedDict(self._desired[name])
+        for group, (added, removed) in self.groups.items():
+            for name in removed:
+                inventory.remove_from_group(group, name)
+            for name in added:
+                inventory.add_to_group(group, name)
+        return inventory
+
+    def lines(self):
+        '''Human readable diff, one change per line'''
+        lines = []
+        for name in self.hosts_added:
+            lines.append('+ host %s %s' % (
+                name, Host(name, self._desired[name]).vars_str()))
+        for name in self.hosts_removed:
+            lines.append('- host %s' % name)
+        for group, (added, removed) in self.groups.items():
+            lines.extend('+ %s: %s' % (group, name) for name in added)
+            lines.extend('- %s: %s' % (group, name) for name in removed)
+        for name, changes in self.hostvars.items():
+            for var, old, new in changes:
+                lines.append('~ %s %s: %s -> %s' % (name, var, old, new))
+        return lines
+
+
+def inventory_format(path, default=None):
+    '''Inventory file format: ini, yaml or json'''
+    if default:
+        return default
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.yml', '.yaml'):
+        return 'yaml'
+    if ext == '.json':
+        return 'json'
+    return 'ini'
+
+
+def read_ini(path):
+    '''
+    Parse an INI inventory. Returns the Inventory and its section names
+    '''
+    read_cparser = configparser.ConfigParser(allow_no_value=True)
+    read_cparser.optionxform = str
+    read_cparser.read(path)
+    inventory = Inventory()
+    for section in ['all'] + list(Inventory.GROUPS):
+        if not read_cparser.has_section(section):
+            continue
+        for line, properties_str in read_cparser.items(section):
+            machine_part = line.split('#', 1)[0]  # get rid of comments parts
+            machine_part = machine_part.split(None, 1)
+            inventory_hostname = machine_part[0]
+            hostvars = OrderedDict()
+            if len(machine_part) == 2:
+                if properties_str:
+                    properties_str = machine_part[1] + '=' + properties_str
+                else:
+                    properties_str = machine_part[1]
+                for hostvar in properties_str.split():
+                    name, value = hostvar.split('=', 1)
+                    hostvars[name] = value
+            inventory.add_host(inventory_hostname, hostvars)
+            if section != 'all':
+                inventory.add_to_group(section, inventory_hostname)
+    return inventory, set(read_cparser.sections())
+
+
+def hostvars_str(hostvars):
+    '''
+    Variables of a YAML or JSON host as strings, like the INI inventory
+    ones: the rest of kubespray reads and writes them as text
+    '''
+    result = OrderedDict()
+    for name, value in (hostvars or {}).items():
+        if value is None:
+            value = ''
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif not isinstance(value, str):
+            value = str(value)
+        result[str(name)] = value
+    return result
+
+
+def read_structured(path, fmt):
+    '''
+    Parse a YAML or JSON inventory (Ansible's yaml inventory layout).
+    Returns the Inventory and the equivalent INI section names
+    '''
+    with open(path) as f:
+        if fmt == 'json':
+            data = json.load(f)
+        else:
+            from kubespray import yamlio
+            try:
+                data = yamlio.loads(f)
+            except yamlio.YAMLError as e:
+                raise ValueError(str(e))
+    if not isinstance(data, dict) or not isinstance(data.get('all'), dict):
+        return Inventory(), set()
+    inventory = Inventory()
+    sections = set(['all'])
+    for name, hostvars in (data['all'].get('hosts') or {}).items():
+        inventory.add_host(str(name), hostvars_str(hostvars))
+    for group, content in (data['all'].get('children') or {}).items():
+        content = content or {}
+        if content.get('children'):
+            sections.add('%s:children' % group)
+            continue
+        sections.add(group)
+        for name, hostvars in (content.get('hosts') or {}).items():
+            inventory.add_host(str(name), hostvars_str(hostvars))
+            inventory.add_to_group(group, str(name))
+    return inventory, sections
+
+
+def iter_ini(inventory):
+    for section, entries in inventory.sections():
+        yield '[%s]\n' % section
+        for hostname, hostvars in entries:
+            yield '%s\t\t%s\n' % (hostname, hostvars)
+        yield '\n'
+
+
+def iter_yaml(inventory):
+    '''
+    Ansible's yaml inventory layout. Scalars are written as JSON strings
+    which are valid YAML.
+    '''
+    yield 'all:\n  hosts:\n'
+    for host in inventory:
+        if host.hostvars:
+            yield '    %s:\n' % json.dumps(host.name)
+            for name, value in host.hostvars.items():
+                yield '      %s: %s\n' % (name, json.dumps(value))
+        else:
+            yield '    %s: {}\n' % json.dumps(host.name)
+    yield '  children:\n'
+    for group, members in inventory.groups.items():
+        yield '    %s:\n      hosts:\n' % group
+        for name in members:
+            yield '        %s: {}\n' % json.dumps(name)
+    for group, children in inventory.CHILDREN.items():
+        yield '    %s:\n      children:\n' % group
+        for child in children:
+            yield '        %s: {}\n' % child
+    yield '\n'
+
+
+def iter_json(inventory):
+    '''Same layout as iter_yaml'''
+    yield '{"all": {\n "hosts": {'
+    separator = '\n  '
+    for host in inventory:
+        yield '%s%s: %s' % (
+            separator, json.dumps(host.name), json.dumps(host.hostvars))
+        separator = ',\n  '
+    yield '\n },\n "children": {'
+    separator = '\n  '
+    for group, members in inventory.groups.items():
+        yield '%s%s: {"hosts": {%s}}' % (
+            separator, json.dumps(group),
+            ', '.join('%s: {}' % json.dumps(name) for name in members)
+        )
+        separator = ',\n  '
+    for group, children in inventory.CHILDREN.items():
+        yield '%s%s: {"children": {%s}}' % (
+            separator, json.dumps(group),
+            ', '.join('%s: {}' % json.dumps(c) for c in children)
+        )
+    yield '\n }\n}}\n'
+
+
+writers = {'ini': iter_ini, 'yaml': iter_yaml, 'json': iter_json}
+
+
+def read_file(path, fmt):
+    if fmt == 'ini':
+        return read_ini(path)
+    return read_structured(path, fmt)
+
+
+def dynamic_cache_path(path):
+    '''Where the --list output of an inventory file is cached'''
+    return os.path.join(
+        os.path.dirname(os.path.abspath(path)),
+        '.%s.dynamic.json' % os.path.basename(path)
+    )
+
+
+def write_dynamic_cache(path, inventory):
+    '''
+    Cache the --list output of the inventory file at path, keyed by the
+    file mtime and size. Best effort: the cache is only an optimization.
+    '''
+    try:
+        st = os.stat(path)
+        doc = {'source': [st.st_mtime_ns, st.st_size],
+               'inventory': inventory.to_dynamic()}
+        write_atomic(dynamic_cache_path(path), [json.dumps(doc)])
+    except (IOError, OSError):
+        pass
+
+
+def load_dynamic(path, fmt=None):
+    '''
+    The --list document of an inventory file, from its cache when the file
+    did not change since. Raises IOError or ValueError when the inventory
+    cannot be read.
+    '''
+    st = os.stat(path)
+    try:
+        with open(dynamic_cache_path(path)) as f:
+            doc = json.load(f, object_pairs_hook=OrderedDict)
+        if doc['source'] == [st.st_mtime_ns, st.st_size]:
+            return doc['inventory']
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+    try:
+        inventory, sections = read_file(path, inventory_format(path, fmt))
+    except configparser.Error as e:
+        raise ValueError(str(e))
+    write_dynamic_cache(path, inventory)
+    return inventory.to_dynamic()
+
+
+def print_dynamic(path, fmt=None, host=None):
+    '''
+    Act as an Ansible inventory script: print the whole inventory, or the
+    variables of a host
+    '''
+    try:
+        data = load_dynamic(path, fmt)
+    except (IOError, OSError, ValueError) as e:
+        display.error('Cannot read inventory %s: %s' % (path, e))
+        sys.exit(1)
+    if host is not None:
+        data = data['_meta']['hostvars'].get(host, {})
+    sys.stdout.write(json.dumps(data, indent=2) + '\n')
+
+
+def instance_name(result):
+    '''
+    Name of an OpenStack instance from the result of its looped
+    provisioning task. With async provisioning the item is the result of
+    the started job, whose item is the instance: {'name': ...}
+    '''
+    entry = result['item']
+    while isinstance(entry, dict) and 'item' in entry:
+        entry = entry['item']
+    return entry['name'] if isinstance(entry, dict) else entry
+
 
 class CfgInventory(object):
     '''
@@ -45,104 +499,95 @@ class CfgInventory(object):
         self.platform = platform
         self.inventorycfg = options['inventory_path']
         self.logger = get_logger(options.get('logfile'), options.get('loglevel'))
-        self.cparser = configparser.ConfigParser(allow_no_value=True)
-        self.inventory = {'all': {'hosts': []},
-                          'kube-master': {'hosts': []},
-                          'etcd': {'hosts': []},
-                          'kube-node': {'hosts': []},
-                          'k8s-cluster:children': {'hosts': [
-                              {'hostname': 'kube-node', 'hostvars': []},
-                              {'hostname': 'kube-master', 'hostvars': []}
-                          ]},
-                          }
+        self.format = inventory_format(
+            self.inventorycfg, options.get('inventory_format')
+        )
+        # Changes made by the last write_inventory with --add
+        self.diff = None
+
+    def used_cluster_names(self):
+        '''
+        Names of the clusters found in the current inventory file,
+        hostnames are made of the cluster name and a random suffix
+        '''
+        if not os.path.isfile(self.inventorycfg):
+            return set()
+        try:
+            inventory, sections = self.read_file()
+        except (IOError, ValueError, configparser.Error):
+            return set()
+        names = set()
+        for host in inventory:
+            if host.name.startswith('k8s-'):
+                names.add('-'.join(host.name[4:].split('-')[:-1]))
+        return names
+
+    def new_cluster_name(self):
+        return 'k8s-' + get_cluster_name(
+            self.options.get('cluster_name_seed'), self.used_cluster_names()
+        )
+
+    @property
+    def cluster_name(self):
+        return self.load().cluster_name
+
+    def load(self):
+        '''
+        The inventory file parsed once per process: it is parsed again only
+        when its mtime or size changed. The returned Inventory is shared and
+        must not be modified, use read_inventory to get a copy.
+        '''
+        path = os.path.abspath(self.inventorycfg)
+        try:
+            st = os.stat(path)
+            key = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            key = None
+        cached = _inventory_cache.get(path)
+        if key is not None and cached is not None and cached[0] == key:
+            return cached[1]
+        inventory = self.parse_inventory()
+        if key is not None:
+            _inventory_cache[path] = (key, inventory)
+        return inventory
 
     def read_inventory(self):
-        read_cparser = configparser.ConfigParser(allow_no_value=True)
+        return self.load().copy()
+
+    def read_file(self):
+        return read_file(self.inventorycfg, self.format)
+
+    def parse_inventory(self):
         try:
-            read_cparser.read(self.inventorycfg)
-        except IOError as e:
+            current_inventory, sections = self.read_file()
+        except (IOError, ValueError, configparser.Error) as e:
             display.error('Cannot read configuration %s: %s'
                           % (self.options['inventory_path'], e)
                           )
             sys.exit(1)
         expected_sections = ['kube-node', 'kube-master', 'all', 'etcd', 'k8s-cluster:children']
         for k in expected_sections:
-            if k not in read_cparser.sections():
+            if k not in sections:
                 display.error(
                     'The config file %s doesn\'t have a section named %s'
                     % (self.options['inventory_path'], k)
                 )
                 sys.exit(1)
-        current_inventory = {'all': {'hosts': []},
-                             'kube-master': {'hosts': []},
-                             'etcd': {'hosts': []},
-                             'kube-node': {'hosts': []},
-                             'k8s-cluster:children': {'hosts': [
-                                 {'hostname': 'kube-node', 'hostvars': []},
-                                 {'hostname': 'kube-master', 'hostvars': []}
-                             ]},
-                             }
-        for section in list(current_inventory.keys()):
-            for line, properties_str in read_cparser.items(section):
-                machine_part = line.split('#', 1)[0]  # get rid of comments parts
-                machine_part = line.split(None, 1)
-                inventory_hostname = machine_part[0]
-                host_dict = {'hostname': '', 'hostvars': []}
-                hostvars = []
-                if len(machine_part) == 2:
-                    if properties_str:
-                        properties_str = machine_part[1] + '=' + properties_str
-                    else:
-                        properties_str = machine_part[1]
-                    for hostvar in properties_str.split():
-                        name, value = hostvar.split('=')
-                        d = {'name': name, 'value': value}
-                        hostvars.append(d)
-                host_dict['hostname'] = inventory_hostname
-                host_dict['hostvars'] = hostvars
-                current_inventory[section]['hosts'].append(host_dict)
         return(current_inventory)
 
     def format_inventory(self, masters, nodes, etcds):
-        new_inventory = {'all': {'hosts': []},
-                         'kube-master': {'hosts': []},
-                         'etcd': {'hosts': []},
-                         'kube-node': {'hosts': []},
-                         'k8s-cluster:children': {'hosts': [
-                             {'hostname': 'kube-node', 'hostvars': []},
-                             {'hostname': 'kube-master', 'hostvars': []}
-                             ]},
-                         }
+        new_inventory = Inventory()
 
         if self.platform == 'openstack':
             if self.options['floating_ip']:
                 ip_type = 'public_v4'
             else:
                 ip_type = 'private_v4'
-            # handle masters
-            new_instances = []
-            for master in masters:
-                entry = master['item']
-                host_name = entry['name'] if isinstance(entry, dict) else entry
-                new_instances.append({'public_ip': master['openstack'][ip_type],
-                                      'name': host_name})
-            masters = new_instances
-            # handle nodes
-            new_instances = []
-            for node in nodes:
-                entry = node['item']
-                host_name = entry['name'] if isinstance(entry, dict) else entry
-                new_instances.append({'public_ip': node['openstack'][ip_type],
-                                      'name': host_name})
-            nodes = new_instances
-            # handle etcds
-            new_instances = []
-            for etcd in etcds:
-                entry = etcd['item']
-                host_name = entry['name'] if isinstance(entry, dict) else entry
-                new_instances.append({'public_ip': etcd['openstack'][ip_type],
-                                      'name': host_name})
-            etcds = new_instances
+            masters, nodes, etcds = [
+                [{'public_ip': instance['openstack'][ip_type],
+                  'name': instance_name(instance)} for instance in instances]
+                for instances in (masters, nodes, etcds)
+            ]
 
         if not self.options['add_node']:
             if not masters and len(nodes) == 1:
@@ -158,73 +603,82 @@ class CfgInventory(object):
 
         if self.platform in ['aws', 'gce', 'openstack']:
             if self.options['add_node']:
-                current_inventory = self.read_inventory()
-                cluster_name = '-'.join(
-                    current_inventory['all']['hosts'][0]['hostname'].split('-')[:-1]
-                )
-                new_inventory = current_inventory
+                new_inventory = self.read_inventory()
+                cluster_name = new_inventory.cluster_name
             else:
-                cluster_name = 'k8s-' + get_cluster_name()
+                cluster_name = self.new_cluster_name()
             if self.options['use_private_ip']:
                 instance_ip = 'private_ip'
             else:
                 instance_ip = 'public_ip'
+            ssh_port = int(self.options.get('ssh_port', 22))
             for host in nodes + masters + etcds:
-                if self.platform == 'aws':
+                # A node may also be a master or an etcd member: name it once
+                if self.platform == 'aws' and 'name' not in host:
                     host['name'] = "%s-%s" % (cluster_name, id_generator(5))
-                new_inventory['all']['hosts'].append(
-                    {'hostname': '%s' % host['name'], 'hostvars': [
-                        {'name': 'ansible_ssh_host', 'value': host[instance_ip]}
-                        ]}
-                )
-            if not self.options['add_node']:
-                for host in nodes:
-                    new_inventory['kube-node']['hosts'].append(
-                        {'hostname': '%s' % host['name'],
-                         'hostvars': []}
-                    )
-                for host in masters:
-                    new_inventory['kube-master']['hosts'].append(
-                        {'hostname': '%s' % host['name'],
-                         'hostvars': []}
-                    )
-                for host in etcds:
-                    new_inventory['etcd']['hosts'].append(
-                        {'hostname': '%s' % host['name'],
-                         'hostvars': []}
-                    )
+                hostvars = OrderedDict([('ansible_ssh_host',
+                                         host[instance_ip])])
+                if ssh_port != 22:
+                    hostvars['ansible_ssh_port'] = str(ssh_port)
+                new_inventory.add_host('%s' % host['name'], hostvars)
+            for group, hosts in [('kube-node', nodes),
+                                 ('kube-master', masters),
+                                 ('etcd', etcds)]:
+                for host in hosts:
+                    new_inventory.add_to_group(group, '%s' % host['name'])
         elif self.platform == 'metal':
+            if self.options['add_node']:
+                new_inventory = self.read_inventory()
             for host in nodes + masters + etcds:
                 if '[' in host:
                     r = re.search('(^.*)\[(.*)\]', host)
                     inventory_hostname = r.group(1)
                     var_str = r.group(2)
-                    hostvars = list()
+                    hostvars = OrderedDict()
                     for var in var_str.split(','):
-                        hostvars.append({'name': var.split('=')[0], 'value': var.split('=')[1]})
+                        hostvars[var.split('=')[0]] = var.split('=')[1]
                 else:
                     inventory_hostname = host
-                    hostvars = []
-                new_inventory['all']['hosts'].append(
-                    {'hostname': inventory_hostname, 'hostvars': hostvars}
-                )
-            for host in nodes:
-                new_inventory['kube-node']['hosts'].append(
-                    {'hostname': host.split('[')[0], 'hostvars': []}
-                )
-            for host in masters:
-                new_inventory['kube-master']['hosts'].append(
-                    {'hostname': host.split('[')[0], 'hostvars': []}
-                )
-            for host in etcds:
-                new_inventory['etcd']['hosts'].append(
-                    {'hostname': host.split('[')[0], 'hostvars': []}
-                )
+                    hostvars = None
+                new_inventory.add_host(inventory_hostname, hostvars)
+            for group, hosts in [('kube-node', nodes),
+                                 ('kube-master', masters),
+                                 ('etcd', etcds)]:
+                for host in hosts:
+                    new_inventory.add_to_group(group, host.split('[')[0])
         return(new_inventory)
 
+    def update_inventory(self, desired):
+        '''
+        Compute the changes from the current inventory to the desired one
+        and apply them to a copy of the current one
+        '''
+        inventory = self.read_inventory()
+        self.diff = InventoryDiff.compute(inventory, desired)
+        display.banner('INVENTORY CHANGES')
+        if not self.diff:
+            display.display('The inventory %s is up to date' % self.inventorycfg)
+            return None
+        for line in self.diff.lines():
+            display.display(line, color={
+                '+': 'green', '-': 'red'}.get(line[0], 'yellow'))
+        self.logger.info('inventory changes: %s' % '; '.join(self.diff.lines()))
+        # Cloud instances are already created, they have to be added
+        if self.platform == 'metal' and not self.options['assume_yes']:
+            if not query_yes_no(
+                'Apply these changes to %s ?' % self.inventorycfg
+            ):
+                display.display('Aborted', color='red')
+                sys.exit(1)
+        return self.diff.apply(inventory)
+
     def write_inventory(self, masters, nodes, etcds):
         '''Generates inventory'''
         inventory = self.format_inventory(masters, nodes, etcds)
+        if self.options['add_node']:
+            inventory = self.update_inventory(inventory)
+            if inventory is None:
+                return
         if not self.options['add_node']:
             if (('masters_count' in list(self.options.keys()) and len(masters) < 2) or
                ('masters_count' not in list(self.options.keys()) and len(nodes) < 2)):
@@ -232,28 +686,23 @@ class CfgInventory(object):
             if (('etcds_count' in list(self.options.keys()) and len(etcds) < 3) or
                ('etcds_count' not in list(self.options.keys()) and len(nodes) < 3)):
                 display.warning('You should set at least 3 nodes for etcd clustering')
-        open(self.inventorycfg, 'w').close()
-        for key, value in list(inventory.items()):
-            self.cparser.add_section(key)
-            for host in value['hosts']:
-                hostvars = str()
-                varlist = list()
-                for var in host['hostvars']:
-                    varlist.append("%s=%s" % (var['name'], var['value']))
-                hostvars = " ".join(varlist)
-                self.cparser.set(key, "%s\t\t%s" % (host['hostname'], hostvars))
-        with open(self.inventorycfg, 'w') as configfile:
-            display.banner('WRITTING INVENTORY')
-            self.cparser.write(configfile)
-            self.logger.info(
-                'the inventory %s was successfuly generated'
-                % self.inventorycfg
-            )
-            self.logger.debug(
-                'The following options were used to generate the inventory: %s'
-                % self.options
-            )
-            display.display(
-                'Inventory generated : %s'
-                % self.inventorycfg, color='green'
-            )
+        display.banner('WRITTING INVENTORY')
+        try:
+            write_atomic(self.inventorycfg, writers[self.format](inventory))
+        except (IOError, OSError) as e:
+            display.error(
+                'Cannot write inventory %s: %s' % (self.inventorycfg, e))
+            sys.exit(1)
+        write_dynamic_cache(self.inventorycfg, inventory)
+        self.logger.info(
+            'the inventory %s was successfuly generated'
+            % self.inventorycfg
+        )
+        self.logger.debug(
+            'The following options were used to generate the inventory: %s'
+            % self.options
+        )
+        display.display(
+            'Inventory generated : %s'
+            % self.inventorycfg, color='green'
+        )
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.logger
+~~~~~~~~~~~~
+
+Process wide logging: JSON records written to a rotated kubespray.log by a
+background thread
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import string
+import time
+
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+_run_id = None
+_listener = None
+_queue_handler = None
+
+
+def run_id():
+    '''
+    Identifier of this kubespray invocation, found on every log record
+    and used to name the run's events log
+    '''
+    global _run_id
+    if _run_id is None:
+        _run_id = '%s-%s' % (
+            time.strftime('%Y%m%d-%H%M%S'),
+            ''.join(random.choice(string.ascii_lowercase + string.digits)
+                    for _ in range(4))
+        )
+    return _run_id
+
+
+class JsonFormatter(logging.Formatter):
+    '''One JSON document per record'''
+
+    def format(self, record):
+        doc = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'run_id': run_id(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            doc['exception'] = self.formatException(record.exc_info)
+        return json.dumps(doc)
+
+
+def setup_logging(logfile, loglevel, max_bytes=LOG_MAX_BYTES,
+                  backup_count=LOG_BACKUP_COUNT):
+    '''
+    Configure the root logger once per process. Records go through a queue
+    to a listener thread which writes them to the rotated logfile.
+    Later calls only update the level.
+    '''
+    global _listener, _queue_handler
+    logger = logging.getLogger()
+    logger.setLevel(getattr(logging, (loglevel or 'info').upper()))
+    if _listener is not None:
+        return logger
+    logdir = os.path.dirname(logfile)
+    if logdir and not os.path.isdir(logdir):
+        os.makedirs(logdir)
+    handler = RotatingFileHandler(
+        logfile, maxBytes=max_bytes, backupCount=backup_count, delay=True
+    )
+    handler.setFormatter(JsonFormatter())
+    records = queue.Queue(-1)
+    _queue_handler = QueueHandler(records)
+    logger.addHandler(_queue_handler)
+    _listener = QueueListener(records, handler)
+    _listener.start()
+    atexit.register(stop_logging)
+    return logger
+
+
+def stop_logging():
+    '''Write the queued records and stop the listener thread'''
+    global _listener, _queue_handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
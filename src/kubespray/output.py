@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.output
+~~~~~~~~~~~~
+
+Ansible output pipeline: the terminal, the last lines of each host and a
+compressed log of the whole output, written by background threads so
+neither a slow terminal nor the disk holds the playbook up
+"""
+
+import collections
+import gzip
+import os
+import queue
+import re
+import sys
+import threading
+
+TAIL_LINES = 20
+# Hosts whose last lines are printed after a failure, the others are
+# only in the output log
+MAX_DUMPED_HOSTS = 10
+LOG_MAX_MB = 100
+# Fast compression: the log is written while the playbook runs
+GZIP_LEVEL = 1
+# Lines waiting for the terminal before new ones are dropped
+MAX_PENDING_LINES = 10000
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Colour codes of the lines, bin/kubespray forces Ansible's colours
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+# "ok: [node1]", "fatal: [node1 -> master1]: FAILED! => ..."
+HOST_LINE = re.compile(r'^([a-z]+): \[([^\]]+)\]')
+# Verbose connection lines: "<node1> ESTABLISH SSH CONNECTION ..."
+VERBOSE_LINE = re.compile(r'^<([^>\s]+)> ')
+HEADER_LINE = re.compile(r'^(PLAY|TASK|RUNNING HANDLER|PLAY RECAP)\b')
+FAILED_STATUSES = ('fatal', 'failed', 'unreachable')
+
+
+def output_log_path(events_path, compression='gzip'):
+    '''The output log of a run is stored next to its events log'''
+    base = events_path[:-len('.ndjson')] \
+        if events_path.endswith('.ndjson') else events_path
+    return base + '.log' + COMPRESSIONS[compression]
+
+
+class HostTail(object):
+    '''
+    Line callback keeping the last lines of each host of an Ansible run.
+    Lines are attributed to the host they name, continuation lines (e.g.
+    multi-line results) to the last named host. The task header is kept
+    before the first line of a host in each task.
+    '''
+
+    def __init__(self, lines=TAIL_LINES):
+        self.lines = lines
+        self.hosts = {}
+        self.failed = collections.OrderedDict()
+        self.header = None
+        self.current = None
+
+    def host(self, name):
+        tail = self.hosts.get(name)
+        if tail is None:
+            tail = self.hosts[name] = [
+                collections.deque(maxlen=self.lines), None]
+        return tail
+
+    def __call__(self, line):
+        plain = ANSI_ESCAPE.sub('', line) if '\x1b' in line else line
+        match = HOST_LINE.match(plain)
+        if match is not None:
+            name = match.group(2)
+            if ' -> ' in name:
+                # Delegated task: the line belongs to the inventory host
+                name = name.split(' -> ', 1)[0]
+            if match.group(1) in FAILED_STATUSES:
+                self.failed[name] = None
+        else:
+            match = VERBOSE_LINE.match(plain)
+            if match is not None:
+                name = match.group(1)
+            elif HEADER_LINE.match(plain):
+                self.header = line
+                self.current = None
+                return
+            elif self.current is not None and plain.strip():
+                name = self.current
+            else:
+                return
+        self.current = name
+        tail = self.host(name)
+        if tail[1] is not self.header:
+            # First line of the host in this task
+            tail[1] = self.header
+            if self.header is not None:
+                tail[0].append(self.header)
+        tail[0].append(line)
+
+    def tail(self, name):
+        tail = self.hosts.get(name)
+        return list(tail[0]) if tail is not None else []
+
+    def dump(self, hosts, stream=None, log_path=None,
+             max_hosts=MAX_DUMPED_HOSTS):
+        '''Print the last lines of the hosts'''
+        stream = stream or sys.stdout
+        hosts = [h for h in hosts if h in self.hosts]
+        for name in hosts[:max_hosts]:
+            stream.write('\n--- last %d lines of %s ---\n%s\n' % (
+                self.lines, name, '\n'.join(self.tail(name))))
+        if len(hosts) > max_hosts:
+            stream.write('\n... %d more failed hosts%s\n' % (
+                len(hosts) - max_hosts,
+                ', see %s' % log_path if log_path else ''))
+        stream.flush()
+
+
+class CompressedLog(object):
+    '''
+    Line callback writing the lines to a gzip (or zstd) log. The lines of
+    each chunk read from the command are handed over to a writer thread
+    which compresses them. The log is rotated once when it reaches
+    max_bytes: at most the last 2 * max_bytes are kept.
+    '''
+
+    def __init__(self, path, max_bytes=LOG_MAX_MB * 1024 * 1024,
+                 compression='gzip', queue_size=256):
+        if compression == 'zstd':
+            import zstandard
+            self.compressor = zstandard.ZstdCompressor()
+        elif compression != 'gzip':
+            raise ValueError('Unknown compression %s' % compression)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.lines = []
+        self.error = None
+        self.raw = None
+        self.stream = None
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self._write,
+                                       name='output-log')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __call__(self, line):
+        self.lines.append(line)
+
+    def flush(self):
+        if self.lines:
+            self.queue.put(self.lines)
+            self.lines = []
+
+    def close(self):
+        '''Write the queued lines and wait for the writer thread'''
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    @property
+    def backup_path(self):
+        base, ext = os.path.splitext(self.path)
+        return '%s.1%s' % (base, ext)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.raw = open(self.path, 'wb')
+        if self.compression == 'zstd':
+            self.stream = self.compressor.stream_writer(self.raw)
+        else:
+            self.stream = gzip.GzipFile(
+                fileobj=self.raw, mode='wb', compresslevel=GZIP_LEVEL)
+
+    def _close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.raw is not None and not self.raw.closed:
+            self.raw.close()
+        self.raw = None
+
+    def _write(self):
+        while True:
+            lines = self.queue.get()
+            if lines is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if self.stream is None:
+                    self._open()
+                lines.append('')
+                self.stream.write('\n'.join(lines).encode('utf-8'))
+                if self.raw.tell() >= self.max_bytes:
+                    self._close()
+                    os.replace(self.path, self.backup_path)
+            except (IOError, OSError) as e:
+                self.error = e
+        try:
+            self._close()
+        except (IOError, OSError) as e:
+            self.error = self.error or e
+
+
+class TerminalQueue(object):
+    '''
+    Line callback writing to the terminal from a background thread. When
+    the terminal falls behind by more than max_pending lines, the lines
+    of the new chunks are dropped (they are still in the output log) and
+    a notice tells how many.
+    '''
+
+    def __init__(self, stream=None, max_pending=MAX_PENDING_LINES,
+                 log_path=None):
+        self.stream = stream or sys.stdout
+        self.max_pending = max_pending
+        self.log_path = log_path
+        self.lines = []
+        self.batches = collections.deque()
+        self.pending = 0
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._write,
+                                       name='output-terminal')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __call__(self, line):
+        self.lines.append(line)
+
+    def _notice(self):
+        if self.dropped:
+            self.batches.append(['[kubespray: %d lines not shown%s]' % (
+                self.dropped,
+                ', see %s' % self.log_path if self.log_path else '')])
+            self.pending += 1
+            self.dropped = 0
+
+    def flush(self):
+        if not self.lines:
+            return
+        with self.condition:
+            if self.pending + len(self.lines) > self.max_pending:
+                self.dropped += len(self.lines)
+            else:
+                self._notice()
+                self.batches.append(self.lines)
+                self.pending += len(self.lines)
+                self.condition.notify()
+        self.lines = []
+
+    def close(self):
+        '''Write the queued lines and wait for the writer thread'''
+        self.flush()
+        with self.condition:
+            self._notice()
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def _write(self):
+        while True:
+            with self.condition:
+                while not self.batches and not self.closed:
+                    self.condition.wait()
+                if not self.batches:
+                    return
+                batches = list(self.batches)
+                self.batches.clear()
+            lines = [line for batch in batches for line in batch]
+            lines.append('')
+            try:
+                self.stream.write('\n'.join(lines))
+                self.stream.flush()
+            except (IOError, OSError, ValueError):
+                pass
+            with self.condition:
+                self.pending -= len(lines) - 1
+
+
+class OutputPipeline(object):
+    '''Line callback handing every line over to several callbacks'''
+
+    def __init__(self, callbacks):
+        self.callbacks = [c for c in callbacks if c is not None]
+
+    def __call__(self, line):
+        for callback in self.callbacks:
+            callback(line)
+
+    def flush(self):
+        for callback in self.callbacks:
+            flush = getattr(callback, 'flush', None)
+            if flush is not None:
+                flush()
+
+    def close(self):
+        for callback in self.callbacks:
+            close = getattr(callback, 'close', None)
+            if close is not None:
+                close()
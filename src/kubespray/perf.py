@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.perf
+~~~~~~~~~~~~
+
+Ansible performance profiles: a per-run ansible.cfg tuned for the size of
+the cluster and the resources of the machine running Ansible
+"""
+
+import os
+import resource
+import shlex
+
+from collections import OrderedDict
+from kubespray.events import runs_dir
+from kubespray.fileutil import write_atomic
+from kubespray.logger import run_id
+from kubespray.state import facts_dir, fact_cache_timeout
+
+try:
+    import configparser
+except ImportError:
+    import configparser as configparser
+
+# safe only raises the forks and keeps the SSH connections open a bit
+# longer. Pipelining needs sudo without requiretty, smart gathering reuses
+# the cached facts.
+PROFILES = OrderedDict([
+    ('safe', {'forks_per_cpu': 2, 'max_forks': 10, 'control_persist': '60s',
+              'pipelining': False, 'gathering': 'implicit'}),
+    ('fast', {'forks_per_cpu': 8, 'max_forks': 50, 'control_persist': '30m',
+              'pipelining': True, 'gathering': 'smart'}),
+    ('max', {'forks_per_cpu': 16, 'max_forks': 200, 'control_persist': '60m',
+             'pipelining': True, 'gathering': 'smart'}),
+])
+# Descriptors used by a fork: the ssh pipes, the control socket, the
+# result queue...
+FDS_PER_FORK = 8
+RESERVED_FDS = 64
+
+
+def fd_limit(raise_soft=False):
+    '''
+    The open files limit, raised to the hard limit first if asked to:
+    the children inherit it.
+    '''
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if raise_soft and soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        soft = 65536
+    return soft
+
+
+def compute_forks(profile, host_count, cpus=None, fds=None):
+    '''
+    No more forks than hosts, than the profile allows for the local CPUs
+    and than the open files limit can sustain
+    '''
+    settings = PROFILES[profile]
+    cpus = cpus or os.cpu_count() or 1
+    if fds is None:
+        fds = fd_limit(raise_soft=profile == 'max')
+    forks = min(
+        settings['forks_per_cpu'] * cpus,
+        settings['max_forks'],
+        max((fds - RESERVED_FDS) // FDS_PER_FORK, 1),
+    )
+    if host_count:
+        forks = min(forks, host_count)
+    return max(forks, 1)
+
+
+def control_path_dir():
+    '''
+    ssh control sockets paths are limited to ~100 characters: keep the
+    directory short, the socket name is a hash (%C)
+    '''
+    return os.path.join(os.path.expanduser('~'), '.ansible', 'cp')
+
+
+def ssh_args(base, control_persist):
+    '''
+    The ssh arguments of kubespray's ansible.cfg, with our connection
+    multiplexing options instead of its own
+    '''
+    args = shlex.split(base or '')
+    kept = []
+    i = 0
+    while i < len(args):
+        if args[i] == '-o' and i + 1 < len(args) and \
+                args[i + 1].split('=')[0] in ('ControlMaster',
+                                              'ControlPersist'):
+            i += 2
+            continue
+        kept.append(args[i])
+        i += 1
+    kept.extend(['-o', 'ControlMaster=auto',
+                 '-o', 'ControlPersist=%s' % control_persist])
+    return ' '.join(kept)
+
+
+def profile_settings(options, profile, host_count):
+    '''The ansible.cfg settings of a profile: {section: {key: value}}'''
+    settings = PROFILES[profile]
+    base = configparser.RawConfigParser()
+    base_cfg = os.path.join(options['kubespray_path'], 'ansible.cfg')
+    base.read(base_cfg)
+    config = OrderedDict()
+    for section in base.sections():
+        config[section] = OrderedDict(base.items(section))
+    defaults = config.setdefault('defaults', OrderedDict())
+    defaults['forks'] = str(compute_forks(profile, host_count))
+    defaults['gathering'] = settings['gathering']
+    defaults['fact_caching'] = 'jsonfile'
+    defaults['fact_caching_connection'] = facts_dir(options)
+    defaults['fact_caching_timeout'] = str(fact_cache_timeout(options))
+    # Relative paths of kubespray's ansible.cfg (roles, library...) are
+    # relative to the kubespray directory, not to our generated file
+    for key in ['roles_path', 'library', 'callback_plugins',
+                'filter_plugins']:
+        if key in defaults:
+            defaults[key] = ':'.join(
+                p if p.startswith(('/', '~', '$'))
+                else os.path.normpath(
+                    os.path.join(options['kubespray_path'], p))
+                for p in defaults[key].split(':')
+            )
+    ssh = config.setdefault('ssh_connection', OrderedDict())
+    ssh['pipelining'] = str(settings['pipelining'])
+    ssh['ssh_args'] = ssh_args(
+        ssh.get('ssh_args'), settings['control_persist'])
+    ssh['control_path_dir'] = control_path_dir()
+    ssh['control_path'] = '%(directory)s/%%C'
+    return config
+
+
+def iter_cfg(config):
+    for section, values in config.items():
+        yield '[%s]\n' % section
+        for key, value in values.items():
+            yield '%s = %s\n' % (key, value)
+        yield '\n'
+
+
+def write_profile(options, profile, host_count):
+    '''
+    Write the ansible.cfg of a profile in the runs directory.
+    Returns its path and settings.
+    '''
+    config = profile_settings(options, profile, host_count)
+    path = os.path.join(runs_dir(options), '%s.ansible.cfg' % run_id())
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    write_atomic(path, iter_cfg(config))
+    return path, config
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.probe
+~~~~~~~~~~~~
+
+Concurrent SSH reachability checks
+"""
+
+import asyncio
+import random
+import time
+
+
+class ProbeResult(object):
+    __slots__ = ('host', 'address', 'port', 'latency', 'banner', 'error',
+                 'attempts', 'ready_after')
+
+    def __init__(self, host, address, port):
+        self.host = host
+        self.address = address
+        self.port = port
+        self.latency = None
+        self.banner = None
+        self.error = None
+        self.attempts = 0
+        self.ready_after = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def inventory_targets(inventory):
+    '''
+    (hostname, address, port) of the hosts of an inventory.Inventory, and
+    the names of the hosts whose address or port is a template Ansible
+    resolves (e.g. "{{ ssh_port }}"): they cannot be probed directly
+    '''
+    targets = []
+    templated = []
+    for host in inventory:
+        hostvars = host.hostvars
+        address = hostvars.get(
+            'ansible_ssh_host', hostvars.get('ansible_host', host.name)
+        )
+        port = hostvars.get(
+            'ansible_ssh_port', hostvars.get('ansible_port', 22)
+        )
+        try:
+            port = int(port)
+        except (TypeError, ValueError):
+            templated.append(host.name)
+            continue
+        if '{{' in str(address) or '{%' in str(address):
+            templated.append(host.name)
+            continue
+        targets.append((host.name, address, port))
+    return targets, templated
+
+
+async def probe(target, semaphore, timeout):
+    '''Open a TCP connection and read the SSH banner'''
+    result = ProbeResult(*target)
+    async with semaphore:
+        start = time.monotonic()
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(result.address, result.port), timeout
+            )
+            result.latency = time.monotonic() - start
+            banner = await asyncio.wait_for(
+                reader.readline(), max(timeout - result.latency, 0.1)
+            )
+            result.banner = banner.decode('utf-8', 'replace').strip()
+            if not result.banner.startswith('SSH-'):
+                result.error = 'Not an SSH server: %r' % result.banner[:40]
+        except asyncio.TimeoutError:
+            result.error = 'Timed out after %ss' % timeout
+        except (OSError, UnicodeError) as e:
+            result.error = str(e) or e.__class__.__name__
+        finally:
+            if writer is not None:
+                writer.close()
+    return result
+
+
+async def wait_ready(target, semaphore, timeout, deadline, delay, max_delay):
+    '''
+    Probe a host until it answers with an SSH banner or the deadline
+    (a time.monotonic() value) is reached, backing off between attempts
+    '''
+    start = time.monotonic()
+    attempts = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        result = await probe(target, semaphore, max(min(timeout, remaining),
+                                                    0.1))
+        attempts += 1
+        result.attempts = attempts
+        if result.ok:
+            result.ready_after = time.monotonic() - start
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return result
+        await asyncio.sleep(min(delay * random.uniform(0.8, 1.2), remaining))
+        delay = min(delay * 2, max_delay)
+
+
+async def wait_all(targets, concurrency, timeout, deadline, delay, max_delay):
+    semaphore = asyncio.Semaphore(concurrency)
+    deadline = time.monotonic() + deadline
+    return await asyncio.gather(
+        *[wait_ready(target, semaphore, timeout, deadline, delay, max_delay)
+          for target in targets]
+    )
+
+
+def wait_hosts(targets, deadline=600, concurrency=200, timeout=10, delay=1,
+               max_delay=5):
+    '''
+    Wait until all the targets accept SSH connections, at most deadline
+    seconds in all. Returns the ProbeResult list in the targets order,
+    with the time each host took to become ready.
+    '''
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            wait_all(targets, concurrency, timeout, deadline, delay,
+                     max_delay)
+        )
+    finally:
+        loop.close()
+
+
+async def probe_all(targets, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *[probe(target, semaphore, timeout) for target in targets]
+    )
+
+
+def probe_hosts(targets, concurrency=200, timeout=10):
+    '''
+    Check the SSH port of all the targets, at most concurrency connections
+    at a time. Returns the ProbeResult list in the targets order.
+    '''
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            probe_all(targets, concurrency, timeout)
+        )
+    finally:
+        loop.close()
+
+
+def format_wait_results(results):
+    '''Lines of a table of the hosts, slowest to become ready first'''
+    width = max([len(r.host) for r in results] + [4])
+    lines = ['%-*s  %-15s  %11s  %8s  %s' % (
+        width, 'HOST', 'ADDRESS', 'READY AFTER', 'ATTEMPTS', 'STATUS')]
+    for r in sorted(results, key=lambda r: (r.ok, -(r.ready_after or 0))):
+        lines.append('%-*s  %-15s  %11s  %8d  %s' % (
+            width, r.host, r.address,
+            '%.1fs' % r.ready_after if r.ok else '-', r.attempts,
+            'ready' if r.ok else 'FAILED: %s' % r.error
+        ))
+    return lines
+
+
+def format_results(results):
+    '''Lines of a table of the probe results'''
+    width = max([len(r.host) for r in results] + [4])
+    addresses = ['%s:%s' % (r.address, r.port) for r in results]
+    addr_width = max([len(a) for a in addresses] + [7])
+    lines = ['%-*s  %-*s  %9s  %s' % (
+        width, 'HOST', addr_width, 'ADDRESS', 'LATENCY', 'STATUS')]
+    for r, address in zip(results, addresses):
+        latency = '%.1fms' % (r.latency * 1000) if r.latency else '-'
+        lines.append('%-*s  %-*s  %9s  %s' % (
+            width, r.host, addr_width, address,
+            latency, r.banner if r.ok else 'FAILED: %s' % r.error
+        ))
+    return lines
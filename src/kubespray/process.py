@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.process
+~~~~~~~~~~~~
+
+Event driven execution of external commands
+"""
+
+import collections
+import errno
+import os
+import selectors
+import signal
+import sys
+import time
+
+from subprocess import PIPE, STDOUT, Popen, TimeoutExpired
+
+
+class CommandTimeout(Exception):
+    '''
+    Raised when a command exceeds its wall-clock or idle timeout
+    '''
+
+
+class LineBuffer(object):
+    '''
+    Split a byte stream into decoded lines.
+    A partial line never grows beyond max_line bytes: it is emitted as is.
+    '''
+
+    def __init__(self, callback, max_line=65536):
+        self.callback = callback
+        self.max_line = max_line
+        self.pending = b''
+
+    def feed(self, data):
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.emit(line)
+        while len(self.pending) > self.max_line:
+            self.emit(self.pending[:self.max_line])
+            self.pending = self.pending[self.max_line:]
+
+    def close(self):
+        if self.pending:
+            self.emit(self.pending)
+            self.pending = b''
+
+    def emit(self, line):
+        self.callback(line.decode('utf-8', 'replace').rstrip('\r'))
+
+
+class TerminalWriter(object):
+    '''
+    Default line callback: lines are collected and written to the terminal
+    with a single write per chunk read from the process.
+    '''
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lines = []
+
+    def __call__(self, line):
+        self.lines.append(line)
+
+    def flush(self):
+        if not self.lines:
+            return
+        self.lines.append('')
+        self.stream.write('\n'.join(self.lines))
+        self.stream.flush()
+        self.lines = []
+
+
+class ProcessRunner(object):
+    '''
+    Run a command and pump its output through per-line callbacks.
+
+    The output pipes are non-blocking and multiplexed with a selector, so
+    the runner sleeps until the process writes something or a timeout
+    expires. Only the last tail_lines lines are kept in memory.
+    '''
+
+    def __init__(self, cmd, on_line=None, timeout=None, idle_timeout=None,
+                 env=None, new_group=None, pass_fds=(), tail_lines=20,
+                 max_line=65536, chunk_size=65536, grace_period=10):
+        self.cmd = cmd
+        self.on_line = on_line or TerminalWriter()
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.env = env
+        # By default a child gets its own process group unless we are
+        # attached to a terminal: the terminal already signals the whole
+        # foreground group and the child may need it for prompts.
+        if new_group is None:
+            new_group = not sys.stdin.isatty()
+        self.new_group = new_group
+        # Handed over to the child: closed here once it is started
+        self.pass_fds = tuple(pass_fds)
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.max_line = max_line
+        self.chunk_size = chunk_size
+        self.grace_period = grace_period
+        self.streams = []
+        self.proc = None
+        self.returncode = None
+
+    def add_stream(self, fd, on_line):
+        '''
+        Pump an additional file descriptor (e.g. the read end of a pipe
+        passed to the child) along with the process output.
+        The descriptor is closed when the run is over.
+        '''
+        self.streams.append((fd, on_line))
+
+    def _record(self, line):
+        self.tail.append(line)
+        self.on_line(line)
+
+    def _flush(self):
+        for callback in [self.on_line] + [s[1] for s in self.streams]:
+            flush = getattr(callback, 'flush', None)
+            if flush is not None:
+                flush()
+
+    def _signal(self, signum):
+        if self.proc.poll() is not None:
+            return
+        try:
+            if self.new_group:
+                os.killpg(self.proc.pid, signum)
+            else:
+                self.proc.send_signal(signum)
+        except ProcessLookupError:
+            pass
+
+    def _terminate(self):
+        '''Stop the process (group), escalating to SIGKILL'''
+        self._signal(signal.SIGTERM)
+        try:
+            self.proc.wait(self.grace_period)
+        except TimeoutExpired:
+            self._signal(signal.SIGKILL)
+            self.proc.wait()
+
+    def _interrupt(self):
+        '''
+        Forward an interruption to the process group and give it some
+        time to shut down cleanly
+        '''
+        if self.new_group:
+            self._signal(signal.SIGINT)
+        try:
+            self.proc.wait(self.grace_period)
+        except TimeoutExpired:
+            self._terminate()
+
+    def _wait_time(self, started, last_output):
+        wait = 1.0
+        now = time.monotonic()
+        if self.timeout:
+            wait = min(wait, started + self.timeout - now)
+        if self.idle_timeout:
+            wait = min(wait, last_output + self.idle_timeout - now)
+        return max(wait, 0)
+
+    def _check_timeouts(self, started, last_output):
+        now = time.monotonic()
+        if self.timeout and now - started >= self.timeout:
+            self._terminate()
+            raise CommandTimeout(
+                'timed out after %s seconds' % self.timeout)
+        if self.idle_timeout and now - last_output >= self.idle_timeout:
+            self._terminate()
+            raise CommandTimeout(
+                'no output during %s seconds' % self.idle_timeout)
+
+    def _pump(self):
+        selector = selectors.DefaultSelector()
+        try:
+            outputs = [(self.proc.stdout.fileno(), self._record)]
+            for fd, callback in outputs + self.streams:
+                os.set_blocking(fd, False)
+                selector.register(
+                    fd, selectors.EVENT_READ,
+                    LineBuffer(callback, self.max_line)
+                )
+            started = last_output = time.monotonic()
+            while selector.get_map():
+                events = selector.select(
+                    self._wait_time(started, last_output))
+                for key, mask in events:
+                    try:
+                        data = os.read(key.fd, self.chunk_size)
+                    except BlockingIOError:
+                        continue
+                    if not data:
+                        selector.unregister(key.fd)
+                        key.data.close()
+                        continue
+                    key.data.feed(data)
+                    last_output = time.monotonic()
+                self._flush()
+                if not events and self.proc.poll() is not None:
+                    # The process is gone but a daemonized grandchild
+                    # (e.g. an ssh control master) still holds the pipe
+                    break
+                self._check_timeouts(started, last_output)
+            for key in list(selector.get_map().values()):
+                key.data.close()
+            self._flush()
+        finally:
+            selector.close()
+        return self.proc.wait()
+
+    def _close_streams(self):
+        for fd, callback in self.streams:
+            os.close(fd)
+        self.streams = []
+
+    def run(self):
+        '''
+        Start the command and block until it exits. Returns the exit code
+        '''
+        group = {}
+        if self.new_group:
+            # No preexec_fn: it is unsafe with the logging and output
+            # threads running in this process
+            if sys.version_info >= (3, 11):
+                group['process_group'] = 0
+            else:
+                group['start_new_session'] = True
+        try:
+            if not self.cmd or self.cmd[0] is None:
+                raise FileNotFoundError(
+                    errno.ENOENT, 'Executable not found in PATH')
+            self.proc = Popen(
+                self.cmd, stdout=PIPE, stderr=STDOUT, env=self.env,
+                close_fds=True, pass_fds=self.pass_fds, shell=False,
+                **group
+            )
+        except (OSError, TypeError):
+            self._close_streams()
+            raise
+        finally:
+            for fd in self.pass_fds:
+                os.close(fd)
+        try:
+            self.returncode = self._pump()
+        except KeyboardInterrupt:
+            self._interrupt()
+            raise
+        finally:
+            self.proc.stdout.close()
+            self._close_streams()
+            if self.proc.returncode is not None:
+                self.returncode = self.proc.returncode
+        return self.returncode
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.profiler
+~~~~~~~~~~~~
+
+Timing report of a recorded deployment run
+"""
+
+import os
+import sys
+
+from collections import OrderedDict
+from kubespray.events import EventRecorder, runs_dir
+from kubespray.common import display
+
+
+def list_runs(options):
+    '''Recorded runs, oldest first'''
+    directory = runs_dir(options)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory)
+        if f.endswith('.ndjson')
+    )
+
+
+def find_run(options, run=None):
+    '''
+    A run is either a path, a run id (the file name in the runs directory)
+    or 'latest'
+    '''
+    if run and os.path.isfile(run):
+        return run
+    runs = list_runs(options)
+    if run in (None, 'latest'):
+        if not runs:
+            display.error('No recorded run in %s' % runs_dir(options))
+            sys.exit(1)
+        return runs[-1]
+    if run == 'previous':
+        if len(runs) < 2:
+            display.error('No previous run in %s' % runs_dir(options))
+            sys.exit(1)
+        return runs[-2]
+    for path in runs:
+        if os.path.basename(path) in (run, run + '.ndjson'):
+            return path
+    display.error('Cannot find the run %s in %s' % (run, runs_dir(options)))
+    sys.exit(1)
+
+
+def role_of(task_name):
+    '''Kubespray task names are prefixed by their role: "etcd : Install"'''
+    if ' : ' in task_name:
+        return task_name.split(' : ', 1)[0]
+    return '(playbook)'
+
+
+def format_duration(seconds):
+    if seconds >= 60:
+        return '%dm%02ds' % divmod(int(round(seconds)), 60)
+    return '%.1fs' % seconds
+
+
+class RunProfile(object):
+    '''
+    Where the time of a run went: with Ansible's linear strategy a task is
+    over once its slowest host is done, so every task has a limiting host.
+    '''
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    @classmethod
+    def load(cls, path):
+        return cls(EventRecorder.load(path))
+
+    @property
+    def duration(self):
+        if self.recorder.start is None:
+            return 0
+        return self.recorder.end - self.recorder.start
+
+    def slowest_tasks(self, top=10):
+        tasks = sorted(
+            self.recorder.tasks.values(), key=lambda t: t.duration,
+            reverse=True
+        )
+        return tasks[:top]
+
+    def limiting_host(self, task):
+        '''
+        The host the others waited for and how long they waited for it
+        (the gap with the second slowest host)
+        '''
+        ends = sorted(
+            [(h.end, name) for name, h in task.hosts.items()
+             if h.end is not None],
+            reverse=True
+        )
+        if not ends:
+            return None, 0
+        if len(ends) == 1:
+            return ends[0][1], 0
+        return ends[0][1], ends[0][0] - ends[1][0]
+
+    def stragglers(self, top=3):
+        '''Per play, the hosts which held up the others the most'''
+        report = OrderedDict()
+        for play in self.recorder.plays:
+            waits = {}
+            for task in play.tasks:
+                host, wait = self.limiting_host(task)
+                if host is not None and wait > 0:
+                    waits[host] = waits.get(host, 0) + wait
+            report[play] = sorted(
+                waits.items(), key=lambda w: w[1], reverse=True)[:top]
+        return report
+
+    def critical_path(self):
+        '''
+        The chain of (task, limiting host, duration) that made up the run,
+        in execution order
+        '''
+        return [(task, self.limiting_host(task)[0], task.duration)
+                for task in self.recorder.tasks.values()]
+
+    def time_by_role(self):
+        roles = {}
+        for task, host, duration in self.critical_path():
+            role = role_of(task.name)
+            roles[role] = roles.get(role, 0) + duration
+        return sorted(roles.items(), key=lambda r: r[1], reverse=True)
+
+    def time_by_host(self):
+        '''Critical path time spent waiting for each host'''
+        hosts = {}
+        for task, host, duration in self.critical_path():
+            if host is not None:
+                hosts[host] = hosts.get(host, 0) + duration
+        return sorted(hosts.items(), key=lambda h: h[1], reverse=True)
+
+    def task_durations(self):
+        '''
+        Task durations keyed by (play, task name, occurrence), the same
+        task may run several times in a play
+        '''
+        durations = OrderedDict()
+        seen = {}
+        for task in self.recorder.tasks.values():
+            key = (task.play.name, task.name)
+            seen[key] = seen.get(key, 0) + 1
+            durations[key + (seen[key],)] = task.duration
+        return durations
+
+    def compare(self, other, top=10):
+        '''Tasks which got slower (or faster) than in the other run'''
+        mine = self.task_durations()
+        theirs = other.task_durations()
+        deltas = []
+        for key, duration in mine.items():
+            deltas.append((key, duration - theirs.get(key, 0)))
+        for key, duration in theirs.items():
+            if key not in mine:
+                deltas.append((key, -duration))
+        deltas.sort(key=lambda d: abs(d[1]), reverse=True)
+        return deltas[:top]
+
+
+def print_profile(options, run=None, top=10, compare=None):
+    path = find_run(options, run)
+    profile = RunProfile.load(path)
+    display.banner('PROFILE %s' % os.path.basename(path))
+    display.display('Total duration: %s, %d plays, %d tasks' % (
+        format_duration(profile.duration), len(profile.recorder.plays),
+        len(profile.recorder.tasks)
+    ))
+
+    display.banner('SLOWEST TASKS')
+    for task in profile.slowest_tasks(top):
+        host, wait = profile.limiting_host(task)
+        display.display('%10s  %s (slowest host: %s)' % (
+            format_duration(task.duration), task.name, host or '-'
+        ))
+
+    display.banner('STRAGGLERS')
+    for play, hosts in profile.stragglers().items():
+        if not hosts:
+            continue
+        display.display('%s (%s)' % (play.name, format_duration(play.duration)))
+        for host, wait in hosts:
+            display.display('%10s  %s' % (format_duration(wait), host))
+
+    display.banner('CRITICAL PATH')
+    total = profile.duration or 1
+    for role, duration in profile.time_by_role()[:top]:
+        display.display('%10s %5.1f%%  %s' % (
+            format_duration(duration), 100 * duration / total, role
+        ))
+    display.display('Hosts limiting the most tasks:')
+    for host, duration in profile.time_by_host()[:top]:
+        display.display('%10s %5.1f%%  %s' % (
+            format_duration(duration), 100 * duration / total, host
+        ))
+
+    if compare:
+        other_path = find_run(options, compare)
+        other = RunProfile.load(other_path)
+        display.banner('COMPARED TO %s' % os.path.basename(other_path))
+        display.display('Total duration: %s -> %s' % (
+            format_duration(other.duration), format_duration(profile.duration)
+        ))
+        for (play, name, occurrence), delta in profile.compare(other, top):
+            display.display(
+                '%s%9s  %s' % ('+' if delta >= 0 else '-',
+                               format_duration(abs(delta)), name),
+                color='red' if delta > 0 else 'green'
+            )
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.provision
+~~~~~~~~~~~~
+
+Native provisioning engine: create the cloud instances with libcloud from
+a thread pool instead of running a generated playbook
+"""
+
+import abc
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from kubespray.cloud import PROVISION_CONCURRENCY, PROVISION_TIMEOUT
+from kubespray.common import id_generator
+
+# Instances created by a single API call
+BATCH_SIZE = 50
+
+
+class ProvisionError(Exception):
+    '''
+    Raised when instances cannot be created. nodes are the instances
+    created before the failure, as "name (id)", and left those of them
+    which could not be destroyed.
+    '''
+
+    def __init__(self, message, nodes=(), left=()):
+        Exception.__init__(self, message)
+        self.nodes = list(nodes)
+        self.left = list(left)
+
+
+def describe(name, node):
+    return '%s (%s)' % (name, node.id)
+
+
+class Engine(abc.ABC):
+    '''
+    Create the instances of a role through a libcloud driver, batch_size
+    instances per API call. The drivers hold their connection and are not
+    thread safe: each thread of the pool gets its own.
+    '''
+    batch_size = BATCH_SIZE
+
+    def __init__(self, options, cluster_name):
+        self.options = options
+        self.cluster_name = cluster_name
+        self.timeout = int(options.get('provision_timeout', PROVISION_TIMEOUT))
+        self.local = threading.local()
+        # Connect at once: wrong credentials fail before any API call
+        self.local.driver = self.connect()
+
+    @property
+    def driver(self):
+        '''The driver of the calling thread'''
+        driver = getattr(self.local, 'driver', None)
+        if driver is None:
+            driver = self.local.driver = self.connect()
+        return driver
+
+    @abc.abstractmethod
+    def connect(self):
+        '''A new driver'''
+
+    def batches(self, count):
+        return [min(self.batch_size, count - i)
+                for i in range(0, count, self.batch_size)]
+
+    def new_name(self):
+        return '%s-%s' % (self.cluster_name, id_generator())
+
+    @abc.abstractmethod
+    def create(self, role, count):
+        '''Create count instances, returns [(name, node)]'''
+
+    def wait_running(self, nodes):
+        '''
+        Wait until the nodes are running with an address. The driver lists
+        all the nodes once per poll.
+        '''
+        if self.options['use_private_ip']:
+            interface = 'private_ips'
+        else:
+            interface = 'public_ips'
+        running = self.driver.wait_until_running(
+            nodes, wait_period=5, timeout=self.timeout,
+            ssh_interface=interface
+        )
+        return dict((node.uuid, node) for node, addresses in running)
+
+    def destroy_node(self, node):
+        return self.driver.destroy_node(node)
+
+    def destroy(self, instances, concurrency):
+        '''Destroy the [(name, node)] instances, returns those left'''
+        def destroy(instance):
+            try:
+                return self.destroy_node(instance[1])
+            except Exception:
+                return False
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            destroyed = list(pool.map(destroy, instances))
+        return [instance for instance, ok in zip(instances, destroyed)
+                if not ok]
+
+    def record(self, role, name, node):
+        '''Normalized instance record, as read by CfgInventory'''
+        public_ips = node.public_ips or node.private_ips or [None]
+        private_ips = node.private_ips or node.public_ips or [None]
+        return OrderedDict([
+            ('name', name),
+            ('id', node.id),
+            ('role', role),
+            ('public_ip', public_ips[0]),
+            ('private_ip', private_ips[0]),
+        ])
+
+
+class DummyEngine(Engine):
+    '''
+    libcloud's dummy driver: no API, instances are created at once. The
+    node list of a dummy driver is its cloud: the drivers of the threads
+    share one, and the node ids are numbered after its length.
+    '''
+
+    def __init__(self, options, cluster_name):
+        self.lock = threading.Lock()
+        self.nodes = []
+        Engine.__init__(self, options, cluster_name)
+
+    def connect(self):
+        from libcloud.compute.providers import get_driver
+        from libcloud.compute.types import Provider
+        driver = get_driver(Provider.DUMMY)(0)
+        driver.nl = self.nodes
+        return driver
+
+    def create(self, role, count):
+        size = self.driver.list_sizes()[0]
+        image = self.driver.list_images()[0]
+        created = []
+        for _ in range(count):
+            name = self.new_name()
+            with self.lock:
+                created.append(
+                    (name, self.driver.create_node(name, size, image)))
+        return created
+
+    def destroy_node(self, node):
+        with self.lock:
+            return self.driver.destroy_node(node)
+
+
+class EC2Engine(Engine):
+    '''
+    A RunInstances call creates a batch of instances, their Name tags are
+    then set to their inventory names
+    '''
+
+    def connect(self):
+        from libcloud.compute.providers import get_driver
+        from libcloud.compute.types import Provider
+        return get_driver(Provider.EC2)(
+            self.options['aws_access_key'], self.options['aws_secret_key'],
+            region=self.options['region']
+        )
+
+    def create(self, role, count):
+        from libcloud.compute.base import NodeImage, NodeSize
+        options = self.options
+        size = NodeSize(
+            id=options['%s_instance_type' % role], name=None, ram=None,
+            disk=None, bandwidth=None, price=None, driver=self.driver
+        )
+        image = NodeImage(id=options['ami'], name=None, driver=self.driver)
+        kwargs = {
+            'ex_mincount': count,
+            'ex_maxcount': count,
+            'ex_metadata': dict(
+                kv.split('=', 1) for kv in options.get('tags', [])),
+        }
+        if options.get('key_name'):
+            kwargs['ex_keyname'] = options['key_name']
+        if options.get('%s_instance_profile_name' % role):
+            kwargs['ex_iamprofile'] = \
+                options['%s_instance_profile_name' % role]
+        if options.get('security_group_id'):
+            kwargs['ex_security_group_ids'] = [options['security_group_id']]
+        elif options.get('security_group_name'):
+            kwargs['ex_security_groups'] = [options['security_group_name']]
+        if options.get('vpc_subnet_id'):
+            kwargs['ex_subnet'] = self.driver.ex_list_subnets(
+                subnet_ids=[options['vpc_subnet_id']])[0]
+            kwargs['ex_assign_public_ip'] = options.get(
+                'assign_public_ip', False)
+        nodes = self.driver.create_node(
+            '%s-%s' % (self.cluster_name, role), size, image, **kwargs)
+        if not isinstance(nodes, list):
+            nodes = [nodes]
+        instances = [(self.new_name(), node) for node in nodes]
+        try:
+            for name, node in instances:
+                self.driver.ex_create_tags(node, {'Name': name})
+        except Exception as e:
+            # The batch is not returned: its instances would be leaked
+            left = self.destroy(instances, len(instances))
+            message = 'Cannot name the instances: %s' % e
+            if left:
+                message += ' (not destroyed: %s)' % ', '.join(
+                    describe(name, node) for name, node in left)
+            raise ProvisionError(message)
+        return instances
+
+
+class GCEEngine(Engine):
+    '''
+    A batch of instances is created by a single call, the instances are
+    named after a common base name
+    '''
+
+    def connect(self):
+        from libcloud.compute.providers import get_driver
+        from libcloud.compute.types import Provider
+        options = self.options
+        return get_driver(Provider.GCE)(
+            options['service_account_email'],
+            options.get('pem_file', options.get('credentials_file')),
+            datacenter=options['zone'], project=options['project_id']
+        )
+
+    def create(self, role, count):
+        options = self.options
+        tags = options.get('tags')
+        if isinstance(tags, str):
+            tags = tags.split(',')
+        nodes = self.driver.ex_create_multiple_nodes(
+            self.new_name(), options['%s_machine_type' % role],
+            options['image'], count,
+            ex_network=options.get('network', 'default'),
+            ex_subnetwork=options.get('subnetwork'), ex_tags=tags,
+            ignore_errors=False, timeout=self.timeout
+        )
+        return [(node.name, node) for node in nodes]
+
+
+ENGINES = {'dummy': DummyEngine, 'aws': EC2Engine, 'gce': GCEEngine}
+
+
+def provision(options, cloud, cluster_name, counts):
+    '''
+    Create the instances of the roles ({role: count}), at most
+    provision_concurrency API calls at a time.
+    Returns {role: [instance records]}
+    '''
+    engine_class = ENGINES.get(options.get('native_driver', cloud))
+    if engine_class is None:
+        raise ProvisionError(
+            'The native engine does not support %s' % cloud)
+    try:
+        engine = engine_class(options, cluster_name)
+    except Exception as e:
+        raise ProvisionError('Cannot connect to %s: %s' % (cloud, e))
+    concurrency = int(options.get('provision_concurrency',
+                                  PROVISION_CONCURRENCY))
+    created = OrderedDict((role, []) for role in counts)
+    errors = []
+    # Every batch is waited for, the instances of the batches which
+    # succeeded are destroyed when another one fails
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = dict(
+            (pool.submit(engine.create, role, batch), role)
+            for role, count in counts.items()
+            for batch in engine.batches(count)
+        )
+        for future in as_completed(futures):
+            role = futures[future]
+            try:
+                created[role].extend(future.result())
+            except Exception as e:
+                errors.append('%s: %s' % (role, e))
+    instances = [instance for role_instances in created.values()
+                 for instance in role_instances]
+    running = {}
+    if instances and not errors:
+        try:
+            running = engine.wait_running([node for name, node in instances])
+        except Exception as e:
+            errors.append('Instances not running: %s' % e)
+    if errors:
+        left = engine.destroy(instances, concurrency) if instances else []
+        raise ProvisionError(
+            '; '.join(errors),
+            nodes=[describe(name, node) for name, node in instances],
+            left=[describe(name, node) for name, node in left]
+        )
+    return OrderedDict(
+        (role, [engine.record(role, name, running.get(node.uuid, node))
+                for name, node in instances])
+        for role, instances in created.items()
+    )
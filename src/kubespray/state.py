@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.state
+~~~~~~~~~~~~
+
+What was deployed: hosts of the last successful deployments and the
+Ansible facts cache
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from kubespray.fileutil import write_atomic
+
+STATE_FILE = 'deploy_state.json'
+FACTS_DIR = 'facts'
+FACT_CACHE_TIMEOUT = 86400
+
+
+class DeployState(object):
+    '''
+    Hosts deployed successfully, per inventory file. Stored as JSON in the
+    kubespray path.
+    '''
+
+    def __init__(self, options):
+        self.path = os.path.join(options['kubespray_path'], STATE_FILE)
+        self.inventory = os.path.abspath(options['inventory_path'])
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def deployed_hosts(self):
+        '''
+        Hosts of the last successful deployment with this inventory,
+        None if it was never deployed
+        '''
+        deployment = self.read().get(self.inventory)
+        if deployment is None:
+            return None
+        return deployment['hosts']
+
+    def record(self, hosts, run=None):
+        '''Store the hosts of a successful deployment'''
+        state = self.read()
+        state[self.inventory] = {
+            'hosts': list(hosts),
+            'time': time.time(),
+            'run': run,
+        }
+        write_atomic(self.path, [json.dumps(state, indent=2, sort_keys=True)])
+
+
+def facts_dir(options):
+    return os.path.join(options['kubespray_path'], FACTS_DIR)
+
+
+def fact_cache_timeout(options):
+    return int(options.get('fact_cache_timeout', FACT_CACHE_TIMEOUT))
+
+
+def fact_cache_env(options, env=None, gathering=None):
+    '''
+    Environment enabling Ansible's jsonfile facts cache. With 'smart'
+    gathering, hosts with cached facts are not gathered again.
+    '''
+    env = dict(os.environ if env is None else env)
+    env['ANSIBLE_CACHE_PLUGIN'] = 'jsonfile'
+    env['ANSIBLE_CACHE_PLUGIN_CONNECTION'] = facts_dir(options)
+    env['ANSIBLE_CACHE_PLUGIN_TIMEOUT'] = str(fact_cache_timeout(options))
+    if gathering:
+        env['ANSIBLE_GATHERING'] = gathering
+    return env
+
+
+class FactCache(object):
+    '''
+    The jsonfile facts cache of the deployments. The facts of a host expire
+    after fact_cache_timeout seconds, or as soon as its inventory variables
+    (address, port, user...) change: the variables fingerprint of each
+    host is recorded when its facts are gathered.
+    '''
+    INDEX = '.kubespray_hosts.json'
+
+    def __init__(self, options):
+        self.directory = facts_dir(options)
+        self.timeout = fact_cache_timeout(options)
+        self.index_path = os.path.join(self.directory, self.INDEX)
+
+    @staticmethod
+    def fingerprint(host):
+        return hashlib.sha1(json.dumps(
+            [host.name, host.hostvars], sort_keys=True
+        ).encode('utf-8')).hexdigest()
+
+    def read_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def gathered_at(self, name):
+        try:
+            return os.stat(os.path.join(self.directory, name)).st_mtime
+        except OSError:
+            return None
+
+    def invalidate(self, name):
+        try:
+            os.unlink(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def stale_hosts(self, inventory, hosts=None, refresh=False):
+        '''
+        The hosts whose facts must be gathered. The cached facts of the
+        hosts which changed are removed so Ansible does not use them.
+        '''
+        index = self.read_index()
+        deadline = time.time() - self.timeout
+        stale = []
+        for name in hosts or list(inventory.hosts):
+            host = inventory.get(name)
+            gathered_at = self.gathered_at(name)
+            if gathered_at is not None and (
+                    refresh or index.get(name) != self.fingerprint(host)):
+                self.invalidate(name)
+                gathered_at = None
+            if gathered_at is None or gathered_at < deadline:
+                stale.append(name)
+        return stale
+
+    def record(self, inventory, hosts):
+        '''
+        Record the fingerprint of the hosts whose facts were gathered.
+        Returns the hosts without facts.
+        '''
+        index = self.read_index()
+        missing = []
+        for name in hosts:
+            if self.gathered_at(name) is None:
+                missing.append(name)
+                index.pop(name, None)
+            else:
+                index[name] = self.fingerprint(inventory.get(name))
+        for name in list(index):
+            if name not in inventory:
+                index.pop(name)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        write_atomic(self.index_path, [json.dumps(index, sort_keys=True)])
+        return missing
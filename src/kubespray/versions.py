@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.versions
+~~~~~~~~~~~~
+
+Kubernetes versions supported by the kubespray checkout: the versions
+having checksums in the download variables, indexed once per commit
+"""
+
+import json
+import os
+import re
+import sys
+from subprocess import DEVNULL, CalledProcessError, check_output
+
+from kubespray.common import display
+from kubespray.fileutil import write_atomic
+
+INDEX_FILE = '.kube_versions.json'
+# Bumped when the layout of the index changes
+INDEX_VERSION = 1
+
+# Files with the checksums of the kubernetes binaries, from the oldest
+# kubespray trees to the newest, and the variables holding them
+CHECKSUM_FILES = [
+    'roles/download/vars/kube_versions.yml',
+    'roles/download/defaults/main.yml',
+    'roles/download/defaults/main/checksums.yml',
+    'roles/kubespray-defaults/defaults/main/checksums.yml',
+]
+CHECKSUM_VARS = ['kube_checksum', 'kubelet_checksums', 'kubeadm_checksums',
+                 'hyperkube_checksums']
+VERSION_RE = re.compile(r'^v\d+\.\d+\.\d+')
+
+
+def read_head(path):
+    '''
+    Commit checked out in the git tree path, read from .git without
+    running git. None when it cannot be read that way.
+    '''
+    git_dir = os.path.join(path, '.git')
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+    except (IOError, OSError):
+        return None
+    if not head.startswith('ref:'):
+        return head or None
+    ref = head[len('ref:'):].strip()
+    try:
+        with open(os.path.join(git_dir, ref)) as f:
+            return f.read().strip() or None
+    except (IOError, OSError):
+        pass
+    try:
+        with open(os.path.join(git_dir, 'packed-refs')) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def head_commit(path):
+    '''
+    Commit checked out in the git tree path, None when it cannot be found.
+    A plain checkout is read directly, git rev-parse resolves the others
+    (worktrees, submodules, reference backends).
+    '''
+    head = read_head(path)
+    if head is not None:
+        return head
+    try:
+        head = check_output(
+            ['git', '-C', path, 'rev-parse', '--verify', '-q', 'HEAD'],
+            stderr=DEVNULL, universal_newlines=True
+        ).strip()
+    except (OSError, CalledProcessError):
+        return None
+    return head or None
+
+
+def version_key(version):
+    '''Sort key of v1.10.2 after v1.9.11'''
+    return [int(n) if n.isdigit() else n
+            for n in re.split(r'[.+-]', version.lstrip('v'))]
+
+
+def collect_versions(value, versions):
+    '''
+    Versions of a checksums variable: {version: checksum}, or newer
+    {arch: {version: checksum}}
+    '''
+    if not isinstance(value, dict):
+        return
+    for key, item in value.items():
+        key = str(key)
+        if VERSION_RE.match(key):
+            versions.add(key)
+        else:
+            collect_versions(item, versions)
+
+
+def discover(kubespray_path, disk_cache=None):
+    '''
+    (checksums file, versions) of the first checksums file of the tree
+    which lists versions. Raises ValueError when there is none.
+    '''
+    from kubespray import yamlio
+    for name in CHECKSUM_FILES:
+        path = os.path.join(kubespray_path, name)
+        if not os.path.isfile(path):
+            continue
+        try:
+            document = yamlio.load(path, disk_cache)
+        except (IOError, OSError, yamlio.YAMLError) as e:
+            raise ValueError('Cannot read %s: %s' % (path, e))
+        if not isinstance(document, dict):
+            continue
+        versions = set()
+        for var in CHECKSUM_VARS:
+            collect_versions(document.get(var), versions)
+        if versions:
+            return name, versions
+    raise ValueError(
+        'No kubernetes checksums found in %s (looked for %s)'
+        % (kubespray_path, ', '.join(CHECKSUM_FILES))
+    )
+
+
+class VersionIndex(object):
+    '''
+    Kubernetes versions of the kubespray checkout. They are stored in the
+    kubespray path with the HEAD commit they were found at, so the YAML
+    files are only read again after a checkout.
+    '''
+
+    def __init__(self, options):
+        self.options = options
+        self.kubespray_path = options['kubespray_path']
+        self.path = os.path.join(self.kubespray_path, INDEX_FILE)
+        self.source = None
+        self._versions = None
+
+    def read(self, head):
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(index, dict) or \
+                index.get('version') != INDEX_VERSION or \
+                index.get('head') != head:
+            return None
+        self.source = index.get('source')
+        return frozenset(index.get('versions', []))
+
+    def build(self, head):
+        from kubespray import yamlio
+        self.source, versions = discover(
+            self.kubespray_path, yamlio.cache_dir(self.options)
+        )
+        if head is not None:
+            index = {'version': INDEX_VERSION, 'head': head,
+                     'source': self.source,
+                     'versions': sorted(versions, key=version_key)}
+            try:
+                write_atomic(self.path, [json.dumps(index, indent=2)])
+            except (IOError, OSError):
+                pass
+        return frozenset(versions)
+
+    def versions(self, refresh=False):
+        '''
+        The set of the supported versions. Raises ValueError when the
+        checkout has no checksums file.
+        '''
+        if self._versions is None or refresh:
+            head = head_commit(self.kubespray_path)
+            versions = None
+            if head is not None and not refresh:
+                versions = self.read(head)
+            if versions is None:
+                versions = self.build(head)
+            self._versions = versions
+        return self._versions
+
+    def __contains__(self, version):
+        return version in self.versions()
+
+    def sorted(self):
+        return sorted(self.versions(), key=version_key)
+
+
+def kube_versions(options, refresh=False):
+    '''The index of the kubespray checkout, exits when it cannot be built'''
+    index = VersionIndex(options)
+    try:
+        index.versions(refresh)
+    except ValueError as e:
+        display.error('Cannot find the kubernetes versions: %s' % e)
+        sys.exit(1)
+    return index
+
+
+def print_versions(options, refresh=False):
+    '''Print the supported kubernetes versions, one per line'''
+    if not os.path.isdir(options['kubespray_path']):
+        display.error(
+            'No kubespray checkout in %s, run kubespray prepare or create'
+            ' a cluster first' % options['kubespray_path']
+        )
+        sys.exit(1)
+    index = kube_versions(options, refresh)
+    sys.stdout.write(''.join('%s\n' % v for v in index.sorted()))
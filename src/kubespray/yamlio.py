@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of Kubespray.
+#
+#    Kubespray is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kubespray is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+kubespray.yamlio
+~~~~~~~~~~~~
+
+YAML reading and writing: libyaml's safe loader and dumper when PyYAML was
+built with it, parsed documents cached per process and optionally on disk
+(as JSON: loading it cannot run code)
+"""
+
+import copy
+import hashlib
+import json
+import os
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+from kubespray.fileutil import write_atomic
+
+YAMLError = yaml.YAMLError
+CACHE_DIR = '.yaml_cache'
+# Bumped when the layout of the cache files changes
+CACHE_VERSION = 2
+
+# abspath -> ((mtime, size), document)
+_documents = {}
+
+
+class NoAliasDumper(SafeDumper):
+    '''Safe dumper which never writes anchors and aliases'''
+
+    def ignore_aliases(self, data):
+        return True
+
+
+def loads(stream):
+    '''Parse a YAML string or stream with the safe loader'''
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump(data, stream=None, **kwargs):
+    '''Dump with the safe dumper, without aliases'''
+    kwargs.setdefault('Dumper', NoAliasDumper)
+    return yaml.dump(data, stream, **kwargs)
+
+
+def cache_dir(options):
+    '''
+    Directory of the on-disk cache of the kubespray vars files, None when
+    disabled with yaml_cache: false
+    '''
+    if not options.get('yaml_cache', True):
+        return None
+    return os.path.join(options['kubespray_path'], CACHE_DIR)
+
+
+def cache_path(directory, path):
+    return os.path.join(
+        directory,
+        hashlib.sha1(path.encode('utf-8')).hexdigest() + '.json'
+    )
+
+
+def read_cache(directory, path, key):
+    try:
+        with open(cache_path(directory, path)) as f:
+            cached = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or \
+            cached.get('version') != CACHE_VERSION or \
+            cached.get('path') != path or cached.get('key') != list(key):
+        return None
+    return cached.get('document')
+
+
+def write_cache(directory, path, key, document):
+    '''Best effort: the cache is only an optimization'''
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        content = json.dumps({'version': CACHE_VERSION, 'path': path,
+                              'key': list(key), 'document': document})
+        # Documents JSON cannot hold as they are (dates, non-string keys)
+        # are not cached
+        if json.loads(content)['document'] != document:
+            return
+        write_atomic(cache_path(directory, path), [content])
+    except (IOError, OSError, TypeError, ValueError):
+        pass
+
+
+def load(path, disk_cache=None):
+    '''
+    The document of a YAML file, parsed once per process: it is parsed
+    again only when the file mtime or size changed. With disk_cache (a
+    directory), parsed documents are also kept there for the next
+    processes. The returned document is shared and must not be modified,
+    use read to get a copy.
+
+    Raises IOError/OSError and YAMLError.
+    '''
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _documents.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    document = None
+    if disk_cache:
+        document = read_cache(disk_cache, path, key)
+    if document is None:
+        with open(path) as f:
+            document = loads(f)
+        if disk_cache and document is not None:
+            write_cache(disk_cache, path, key, document)
+    _documents[path] = (key, document)
+    return document
+
+
+def read(path, disk_cache=None):
+    '''Same as load, the caller owns the returned document'''
+    return copy.deepcopy(load(path, disk_cache))